@@ -0,0 +1,127 @@
+# benchmarks/bench_fanout.py
+"""Накладные расходы рассылки на одного получателя: copy_content против старой цепочки.
+
+Bot подменён заглушкой, которая только считает вызовы API (и при желании
+ждёт --latency секунд, как сеть). Старая цепочка if/elif по типам контента
+воспроизведена здесь как была до перехода на copy_message.
+
+Запуск: python benchmarks/bench_fanout.py [--recipients 20000] [--latency 0]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.services.fanout import copy_content, resolve_source, remember_media_group
+
+
+class MockBot:
+    """Заглушка Bot: любой метод send_*/copy_* — корутина, считающая вызовы."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if not name.startswith(('send_', 'copy_')):
+            raise AttributeError(name)
+
+        async def method(**kwargs):
+            self.calls += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+        return method
+
+
+async def legacy_send_content(bot, chat_id, original_msg=None, fallback_text=None):
+    """Старая цепочка из broadcast_jobs.send_content (до copy_message)."""
+    if original_msg:
+        if original_msg.photo:
+            await bot.send_photo(chat_id=chat_id, photo=original_msg.photo[-1].file_id,
+                                 caption=original_msg.caption or "", parse_mode=original_msg.parse_mode)
+        elif original_msg.text:
+            await bot.send_message(chat_id=chat_id, text=original_msg.text, parse_mode=original_msg.parse_mode)
+        elif original_msg.document:
+            await bot.send_document(chat_id=chat_id, document=original_msg.document.file_id,
+                                    caption=original_msg.caption or "", parse_mode=original_msg.parse_mode)
+        elif original_msg.sticker:
+            await bot.send_sticker(chat_id=chat_id, sticker=original_msg.sticker.file_id)
+        elif original_msg.voice:
+            await bot.send_voice(chat_id=chat_id, voice=original_msg.voice.file_id, caption=original_msg.caption or "")
+        elif original_msg.video:
+            await bot.send_video(chat_id=chat_id, video=original_msg.video.file_id,
+                                 caption=original_msg.caption or "", parse_mode=original_msg.parse_mode)
+        elif original_msg.audio:
+            await bot.send_audio(chat_id=chat_id, audio=original_msg.audio.file_id,
+                                 caption=original_msg.caption or "", parse_mode=original_msg.parse_mode)
+        elif original_msg.animation:
+            await bot.send_animation(chat_id=chat_id, animation=original_msg.animation.file_id,
+                                     caption=original_msg.caption or "", parse_mode=original_msg.parse_mode)
+        else:
+            raise ValueError("unsupported")
+    else:
+        await bot.send_message(chat_id=chat_id, text=fallback_text)
+
+
+def _message(message_id=1, media_group_id=None, **content):
+    fields = dict(photo=None, text=None, document=None, sticker=None, voice=None,
+                  video=None, audio=None, animation=None, poll=None, caption=None, parse_mode=None)
+    fields.update(content)
+    return SimpleNamespace(chat_id=-100, message_id=message_id, media_group_id=media_group_id, **fields)
+
+
+def _file(file_id="file"):
+    return SimpleNamespace(file_id=file_id)
+
+
+def _cases() -> dict:
+    album = [_message(10 + i, media_group_id="album", photo=[_file()], caption="альбом" if i == 0 else None)
+             for i in range(5)]
+    for message in album:
+        remember_media_group(message)
+    return {
+        'text': _message(text="Привет"),
+        'photo': _message(photo=[_file(), _file()], caption="Фото"),
+        'animation': _message(animation=_file(), caption="GIF"),  # последняя ветка цепочки
+        'poll': _message(poll=SimpleNamespace(question="?")),
+        'album (5)': album[0],
+    }
+
+
+async def _measure(send, recipients: int) -> float:
+    started = time.perf_counter()
+    for chat_id in range(recipients):
+        await send(chat_id)
+    return (time.perf_counter() - started) / recipients * 1e6
+
+
+async def main(recipients: int, latency: float) -> None:
+    print(f"Получателей: {recipients}, задержка API: {latency * 1000:.1f} мс")
+    print(f"{'контент':<12} {'старая, мкс':>12} {'вызовов':>8} {'copy, мкс':>10} {'вызовов':>8}")
+    for name, message in _cases().items():
+        legacy_bot = MockBot(latency)
+        try:
+            legacy_us = await _measure(lambda chat_id: legacy_send_content(legacy_bot, chat_id, original_msg=message), recipients)
+            legacy = f"{legacy_us:12.2f} {legacy_bot.calls / recipients:8.2f}"
+        except ValueError:
+            legacy = f"{'не поддерж.':>12} {'-':>8}"
+
+        copy_bot = MockBot(latency)
+        # resolve_source, как и в рассылке, выполняется один раз на сообщение, а не на получателя
+        from_chat_id, message_ids = resolve_source(message)
+        copy_us = await _measure(lambda chat_id: copy_content(copy_bot, chat_id, from_chat_id, message_ids), recipients)
+        print(f"{name:<12} {legacy} {copy_us:10.2f} {copy_bot.calls / recipients:8.2f}")
+    print("Альбом в старой цепочке уходил одним фото (остальные 4 терялись), опрос не отправлялся вовсе.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipients', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка одного вызова API, секунды")
+    args = parser.parse_args()
+    asyncio.run(main(args.recipients, args.latency))
@@ -0,0 +1,195 @@
+# benchmarks/bench_update_latency.py
+"""Задержка «обновление появилось → обработчик вызван» в режимах polling и webhook.
+
+Сеть Telegram подменена: в polling вызовы getUpdates обслуживает заглушка
+BaseRequest (long polling, как у настоящего API), в webhook обновления
+POST-запросом приходят на настоящий webhook_handler из run.py, поднятый на
+127.0.0.1. Всё остальное — настоящие Updater/Application PTB. --rtt добавляет
+задержку сети к каждому запросу getUpdates и к каждому POST вебхука.
+
+Запуск: python benchmarks/bench_update_latency.py [--updates 200] [--interval 0.01] [--rtt 0]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web, ClientSession
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+from telegram.request import BaseRequest
+
+WEBHOOK_PATH = '/webhook'
+WEBHOOK_SECRET = 'bench-secret'
+BOT_INFO = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+
+
+def _update_json(update_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 1000 + update_id, 'type': 'private'},
+            'from': {'id': 1000 + update_id, 'is_bot': False, 'first_name': 'user'},
+            'text': '/start',
+        },
+    }
+
+
+class FakeTelegram(BaseRequest):
+    """Заглушка Bot API: getMe, getUpdates с long polling и вебхук-методы."""
+
+    def __init__(self, rtt: float = 0.0):
+        self.rtt = rtt
+        self._updates = []
+        self._arrived = asyncio.Event()
+
+    def push(self, update: dict) -> None:
+        self._updates.append(update)
+        self._arrived.set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def _get_updates(self, parameters: dict) -> list:
+        offset = int(parameters.get('offset') or 0)
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(parameters.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2)
+        if endpoint == 'getMe':
+            result = BOT_INFO
+        elif endpoint == 'getUpdates':
+            result = await self._get_updates(parameters)
+        else:
+            # deleteWebhook, setWebhook и прочее — просто успех
+            result = True
+        if self.rtt:
+            await asyncio.sleep(self.rtt / 2)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+async def _build(fake: FakeTelegram, received: dict):
+    application = ApplicationBuilder().token('1:bench').request(fake).get_updates_request(fake).build()
+
+    async def record(update: Update, context) -> None:
+        received[update.update_id] = time.perf_counter()
+
+    application.add_handler(TypeHandler(Update, record))
+    await application.initialize()
+    await application.start()
+    return application
+
+
+async def _drive(send, updates: int, interval: float, received: dict) -> list:
+    sent = {}
+    for update_id in range(1, updates + 1):
+        sent[update_id] = time.perf_counter()
+        await send(_update_json(update_id))
+        await asyncio.sleep(interval)
+    deadline = time.monotonic() + 10
+    while len(received) < updates and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return [(received[i] - sent[i]) * 1000 for i in sent if i in received]
+
+
+async def bench_polling(updates: int, interval: float, rtt: float) -> list:
+    fake = FakeTelegram(rtt)
+    received = {}
+    application = await _build(fake, received)
+    await application.updater.start_polling(poll_interval=0.0, timeout=10, allowed_updates=Update.ALL_TYPES)
+
+    async def send(update):
+        fake.push(update)
+
+    try:
+        return await _drive(send, updates, interval, received)
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+
+
+async def bench_webhook(updates: int, interval: float, rtt: float) -> list:
+    import run
+    # run.py при импорте включает INFO-логи; для замеров они только мешают
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fake = FakeTelegram()
+    received = {}
+    application = await _build(fake, received)
+    run.bot_application = application
+    run.app_context.update({'mode': 'webhook', 'webhook_secret': WEBHOOK_SECRET})
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, run.webhook_handler)
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f'http://{host}:{port}{WEBHOOK_PATH}'
+
+    async with ClientSession() as session:
+        async def send(update):
+            if rtt:
+                await asyncio.sleep(rtt / 2)
+            async with session.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET}) as response:
+                response.raise_for_status()
+
+        try:
+            return await _drive(send, updates, interval, received)
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            await application.shutdown()
+
+
+def _report(mode: str, latencies: list, updates: int) -> None:
+    if not latencies:
+        print(f"{mode:<8} ни одно обновление не дошло до обработчика")
+        return
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{mode:<8} {len(latencies):>5}/{updates:<5} медиана {statistics.median(latencies):7.2f} мс"
+          f"  p95 {p95:7.2f} мс  макс {latencies[-1]:7.2f} мс")
+
+
+async def main(updates: int, interval: float, rtt: float) -> None:
+    print(f"Обновлений: {updates}, интервал {interval * 1000:.0f} мс, RTT {rtt * 1000:.0f} мс")
+    _report('polling', await bench_polling(updates, interval, rtt), updates)
+    _report('webhook', await bench_webhook(updates, interval, rtt), updates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01, help="пауза между обновлениями, секунды")
+    parser.add_argument('--rtt', type=float, default=0.0, help="задержка сети туда-обратно, секунды")
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.interval, args.rtt))
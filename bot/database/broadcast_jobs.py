@@ -0,0 +1,84 @@
+# bot/database/broadcast_jobs.py
+import logging
+from datetime import datetime, timezone
+from bot.database.core import get_supabase, execute
+from bot.database.user_cache import user_cache, IN_FILTER_CHUNK
+
+logger = logging.getLogger(__name__)
+
+async def create_job(segment: str, title: str, admin_chat_id: int, from_chat_id: int = None,
+                     message_ids: list = None, text: str = None) -> dict:
+    """Создаёт задание рассылки и возвращает его запись."""
+    supabase = get_supabase()
+    response = await execute(supabase.table('broadcast_jobs').insert({
+        'segment': segment,
+        'title': title,
+        'admin_chat_id': admin_chat_id,
+        'from_chat_id': from_chat_id,
+        'message_ids': message_ids,
+        'text': text,
+        'status': 'running',
+    }))
+    job = response.data[0]
+    logger.info(f"🗂️ Создано задание рассылки #{job['id']} ({segment})")
+    return job
+
+def _fenced(query, fencing_token: int = None):
+    """Не даёт бывшему ведущему инстансу перезаписать задание нового ведущего."""
+    if fencing_token is None:
+        return query
+    return query.or_(f"fencing_token.is.null,fencing_token.lte.{fencing_token}")
+
+async def claim_job(job_id: int, fencing_token: int) -> bool:
+    """Закрепляет задание за ведущим с этим токеном. False — оно уже у более нового ведущего."""
+    supabase = get_supabase()
+    response = await execute(_fenced(
+        supabase.table('broadcast_jobs').update({'fencing_token': fencing_token}).eq('id', job_id), fencing_token
+    ))
+    return bool(response.data)
+
+async def save_checkpoint(job_id: int, cursor: int, sent: int, failed: int, fencing_token: int = None) -> bool:
+    """Запоминает, до какого user_id рассылка уже выполнена. False — запись отклонена fencing."""
+    supabase = get_supabase()
+    response = await execute(_fenced(supabase.table('broadcast_jobs').update({
+        'cursor': cursor,
+        'sent': sent,
+        'failed': failed,
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+    }).eq('id', job_id), fencing_token))
+    return bool(response.data)
+
+async def set_job_status(job_id: int, status: str, fencing_token: int = None) -> bool:
+    """Меняет статус задания. False — запись отклонена fencing."""
+    supabase = get_supabase()
+    response = await execute(_fenced(supabase.table('broadcast_jobs').update({
+        'status': status,
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+    }).eq('id', job_id), fencing_token))
+    return bool(response.data)
+
+async def get_unfinished_jobs() -> list:
+    """Возвращает задания, прерванные перезапуском бота (в том числе стоявшие на паузе)."""
+    supabase = get_supabase()
+    response = await execute(supabase.table('broadcast_jobs').select('*').in_('status', ['running', 'paused']).order('id'))
+    return response.data or []
+
+async def get_job(job_id: int):
+    """Возвращает задание рассылки по id или None."""
+    supabase = get_supabase()
+    response = await execute(supabase.table('broadcast_jobs').select('*').eq('id', job_id))
+    return response.data[0] if response.data else None
+
+async def mark_unreachable(user_ids) -> None:
+    """Помечает пользователей недоступными для рассылок."""
+    user_ids = sorted(user_ids)
+    if not user_ids:
+        return
+    supabase = get_supabase()
+    now = datetime.now(timezone.utc).isoformat()
+    for start in range(0, len(user_ids), IN_FILTER_CHUNK):
+        chunk = user_ids[start:start + IN_FILTER_CHUNK]
+        await execute(supabase.table('users').update({'unreachable_at': now}).in_('user_id', chunk))
+        for user_id in chunk:
+            user_cache.update(user_id, {'unreachable_at': now})
+    logger.info(f"🧹 Помечено недоступными для рассылок: {len(user_ids)}")
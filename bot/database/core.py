@@ -1,5 +1,8 @@
 import os
+import time
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
 from telegram import User as TgUser
 
@@ -9,6 +12,12 @@ logger = logging.getLogger(__name__)
 # Глобальная переменная для хранения подключения
 supabase: Client = None
 
+# Пул потоков для запросов к Supabase: клиент синхронный, и вызов .execute()
+# прямо в обработчике блокировал бы весь event loop. Размер пула ограничивает
+# число одновременных запросов к PostgREST.
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
 def get_supabase() -> Client:
     """Возвращает подключение к Supabase."""
     global supabase
@@ -23,38 +32,100 @@ def get_supabase() -> Client:
         logger.info("Подключение к Supabase установлено")
     return supabase
 
+async def execute(query):
+    """Выполняет запрос к Supabase в пуле потоков, не блокируя event loop.
+
+    Пока запрос идёт, event loop продолжает получать обновления, выполнять
+    задачи JobQueue и рассылки. Обработчики разных пользователей при этом
+    выполняются параллельно только вместе с concurrent_updates у Application
+    (см. bot/services/update_processor.py).
+
+    Использование: response = await execute(supabase.table('users').select('*'))
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, query.execute)
+
 # bot/database/core.py
+
+# Как часто (в секундах) можно обновлять в БД username/имя одного пользователя
+USER_REFRESH_INTERVAL = float(os.getenv("USER_REFRESH_INTERVAL", "3600"))
+
+# Уже зарегистрированные пользователи: user_id -> ((username, first_name, last_name), время обновления).
+# Время 0 означает «ещё не обновляли в этом процессе».
+_known_users = {}
+
+def _names(user) -> tuple:
+    return (user.username, user.first_name, user.last_name)
+
+async def warm_known_users() -> int:
+    """Загружает зарегистрированных пользователей в _known_users и индекс username (при старте бота)."""
+    # Импорт здесь, чтобы избежать циклического импорта (оба модуля импортируют core)
+    from bot.database.pagination import iter_pages
+    from bot.database.username_index import username_index
+
+    count = 0
+    try:
+        async for page in iter_pages('users', 'user_id, username, first_name, last_name'):
+            for row in page:
+                names = (row.get('username'), row.get('first_name'), row.get('last_name'))
+                _known_users.setdefault(row['user_id'], (names, 0.0))
+                username_index.setdefault(row['user_id'], row.get('username'))
+            count += len(page)
+        logger.info(f"👥 Загружено {count} зарегистрированных пользователей")
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить список пользователей: {e}")
+    return count
+
 async def create_user_if_not_exists(user: TgUser) -> None:
-    """Добавляет пользователя в базу данных, если его там еще нет."""
-    logger.info(f"🔍 Проверка пользователя {user.id} в БД...")
+    """Регистрирует пользователя одним идемпотентным upsert и обновляет его имя.
+
+    Известные пользователи вообще не трогают БД, пока не сменят username или
+    имя; смена записывается не чаще, чем раз в USER_REFRESH_INTERVAL.
+    """
+    names = _names(user)
+    now = time.monotonic()
+    known = _known_users.get(user.id)
+    if known is not None:
+        if known[0] == names or (known[1] and now - known[1] < USER_REFRESH_INTERVAL):
+            return
+
     supabase_client = get_supabase()
     if not supabase_client:
         logger.error("❌ Не удалось подключиться к Supabase")
         return
 
+    # Импорт здесь, чтобы избежать циклического импорта (user_cache импортирует core)
+    from bot.database.user_cache import update_user, user_cache
+
     try:
-        # Используем точное сравнение для user_id (BIGINT)
-        user_exists = supabase_client.table('users').select('user_id').eq('user_id', user.id).execute()
-        if not user_exists.data: # ИСПРАВЛЕНО: было user_exists.
-            logger.info(f"🆕 Пользователь {user.id} не найден, создаем...")
+        if known is None:
             new_user = {
                 "user_id": user.id,
                 "username": user.username,
                 "first_name": user.first_name,
                 "last_name": user.last_name,
-                # --- ДОБАВЛЕНО: новые поля ---
                 "is_banned": False,
                 "banned_features": [],
                 "last_anketa_time": None,
                 "last_appeal_time": None,
-                "can_receive_broadcast": True, # если это поле тоже используется
-                "is_in_squad": False, # если это поле тоже используется
-                "is_in_city": False, # если это поле тоже используется
-                # --- КОНЕЦ ДОБАВЛЕНИЯ ---
+                "can_receive_broadcast": True,
+                "is_in_squad": False,
+                "is_in_city": False,
             }
-            result = supabase_client.table('users').insert(new_user).execute()
-            logger.info(f"✅ Пользователь {user.id} добавлен в БД. Результат: {result}")
-        else:
-            logger.info(f"✅ Пользователь {user.id} уже существует в БД")
+            # INSERT ... ON CONFLICT (user_id) DO NOTHING: параллельные /start не падают
+            # на дубликате, а ответ содержит строку только если она действительно вставлена
+            result = await execute(
+                supabase_client.table('users').upsert(new_user, on_conflict='user_id', ignore_duplicates=True)
+            )
+            if result.data:
+                user_cache.set(user.id, {**new_user, "unreachable_at": None})
+                _known_users[user.id] = (names, now)
+                logger.info(f"✅ Пользователь {user.id} добавлен в БД")
+                return
+
+        # Пользователь уже есть в БД — обновляем имя, оно могло измениться
+        await update_user(user.id, {"username": user.username, "first_name": user.first_name, "last_name": user.last_name})
+        _known_users[user.id] = (names, now)
+        logger.info(f"✏️ Обновлено имя пользователя {user.id}")
     except Exception as e:
         logger.error(f"💥 Ошибка при работе с БД для пользователя {user.id}: {e}", exc_info=True)
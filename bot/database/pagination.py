@@ -0,0 +1,84 @@
+# bot/database/pagination.py
+import os
+import asyncio
+import logging
+from bot.database.core import get_supabase, execute
+
+logger = logging.getLogger(__name__)
+
+# Размер страницы. Должен быть не больше max-rows PostgREST (по умолчанию 1000),
+# иначе страницы будут молча обрезаться.
+PAGE_SIZE = int(os.getenv("DB_PAGE_SIZE", "500"))
+
+def _build_query(table: str, columns: str, apply_filters, key: str, after, page_size: int):
+    query = get_supabase().table(table).select(columns)
+    if apply_filters:
+        query = apply_filters(query)
+    if after is not None:
+        query = query.gt(key, after)
+    return query.order(key).limit(page_size)
+
+async def iter_pages(table: str, columns: str, apply_filters=None, after=None, page_size: int = PAGE_SIZE, key: str = 'user_id'):
+    """Асинхронно отдаёт строки таблицы страницами по keyset-пагинации.
+
+    Страницы идут по возрастанию key (он должен быть среди columns). Следующая
+    страница запрашивается заранее, пока вызывающий код обрабатывает текущую,
+    а в памяти одновременно держится не больше двух страниц.
+    """
+    next_page = asyncio.ensure_future(execute(_build_query(table, columns, apply_filters, key, after, page_size)))
+    try:
+        while True:
+            response = await next_page
+            next_page = None
+            rows = response.data or []
+            if not rows:
+                return
+            if len(rows) == page_size:
+                next_page = asyncio.ensure_future(
+                    execute(_build_query(table, columns, apply_filters, key, rows[-1][key], page_size))
+                )
+            yield rows
+            if next_page is None:
+                return
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+async def iter_rows(table: str, columns: str, apply_filters=None, after=None, page_size: int = PAGE_SIZE, key: str = 'user_id'):
+    """То же, что iter_pages, но по одной строке."""
+    async for page in iter_pages(table, columns, apply_filters, after, page_size, key):
+        for row in page:
+            yield row
+
+async def count_rows(table: str, apply_filters=None) -> int:
+    """Считает строки на стороне БД, не загружая их."""
+    query = get_supabase().table(table).select('*', count='exact', head=True)
+    if apply_filters:
+        query = apply_filters(query)
+    response = await execute(query)
+    return response.count or 0
+
+async def fetch_page(table: str, columns: str, apply_filters=None, after=None, before=None,
+                     page_size: int = PAGE_SIZE, key: str = 'user_id') -> tuple:
+    """Одна страница keyset-пагинации по возрастанию key: (rows, has_more).
+
+    after — страница после этого значения key, before — страница перед ним
+    (для кнопки «назад»). has_more говорит, есть ли строки дальше в направлении
+    запроса; для этого запрашивается на одну строку больше.
+    """
+    query = get_supabase().table(table).select(columns)
+    if apply_filters:
+        query = apply_filters(query)
+    if before is not None:
+        query = query.lt(key, before).order(key, desc=True)
+    else:
+        if after is not None:
+            query = query.gt(key, after)
+        query = query.order(key)
+    response = await execute(query.limit(page_size + 1))
+    rows = response.data or []
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
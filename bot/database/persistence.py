@@ -0,0 +1,204 @@
+# bot/database/persistence.py
+import os
+import copy
+import json
+import pickle
+import sqlite3
+import asyncio
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу состояния. На Render он должен лежать на постоянном диске,
+# иначе состояние не переживёт передеплой.
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_state.sqlite3")
+# Как часто PTB передаёт изменения в persistence (секунды)
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+# Сколько ждать после первого изменения, прежде чем записать всё одной транзакцией
+PERSISTENCE_FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "1"))
+
+# Отметка «удалить запись» в очереди на запись
+_DELETED = object()
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранит состояния ConversationHandler и user_data в локальном SQLite.
+
+    Данные держатся в памяти, а изменения копятся и записываются в файл
+    одной транзакцией с небольшой задержкой, так что запись не мешает
+    обработке обновлений и не требует обращений к Supabase.
+    """
+
+    def __init__(self, path: str = PERSISTENCE_PATH, store_data: PersistenceInput = None,
+                 update_interval: float = PERSISTENCE_UPDATE_INTERVAL, flush_delay: float = PERSISTENCE_FLUSH_DELAY):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.flush_delay = flush_delay
+        self._connection = None
+        self._loaded = False
+        self._user_data = {}
+        self._chat_data = {}
+        self._bot_data = {}
+        self._callback_data = None
+        self._conversations = {}
+        self._pending = {}  # (kind, key) -> значение или _DELETED
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    # --- Работа с файлом ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS persistence ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, PRIMARY KEY (kind, key))"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _load(self) -> None:
+        """Один раз читает всё состояние из файла в память."""
+        if self._loaded:
+            return
+        rows = self._connect().execute("SELECT kind, key, value FROM persistence").fetchall()
+        for kind, key, value in rows:
+            data = pickle.loads(value)
+            if kind == 'user':
+                self._user_data[int(key)] = data
+            elif kind == 'chat':
+                self._chat_data[int(key)] = data
+            elif kind == 'bot':
+                self._bot_data = data
+            elif kind == 'callback':
+                self._callback_data = data
+            elif kind.startswith('conv:'):
+                self._conversations.setdefault(kind[5:], {})[tuple(json.loads(key))] = data
+        self._loaded = True
+        logger.info(f"💾 Загружено состояние из {self.path}: {len(rows)} записей")
+
+    def _write(self, pending: dict) -> None:
+        connection = self._connect()
+        with connection:
+            for (kind, key), value in pending.items():
+                if value is _DELETED:
+                    connection.execute("DELETE FROM persistence WHERE kind = ? AND key = ?", (kind, key))
+                else:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO persistence (kind, key, value) VALUES (?, ?, ?)",
+                        (kind, key, pickle.dumps(value)),
+                    )
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except Exception as e:
+                logger.error(f"❌ Не удалось сохранить состояние в {self.path}: {e}")
+                # Вернём несохранённое в очередь, не затирая более свежие изменения
+                self._pending = {**pending, **self._pending}
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        await self._write_pending()
+
+    def _mark(self, kind: str, key, value) -> None:
+        """Ставит изменение в очередь и планирует отложенную запись."""
+        self._pending[(kind, str(key))] = copy.deepcopy(value) if value is not _DELETED else value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    # --- Чтение ---
+
+    async def get_user_data(self) -> dict:
+        self._load()
+        return copy.deepcopy(self._user_data)
+
+    async def get_chat_data(self) -> dict:
+        self._load()
+        return copy.deepcopy(self._chat_data)
+
+    async def get_bot_data(self) -> dict:
+        self._load()
+        return copy.deepcopy(self._bot_data)
+
+    async def get_callback_data(self):
+        self._load()
+        return copy.deepcopy(self._callback_data)
+
+    async def get_conversations(self, name: str) -> dict:
+        self._load()
+        return dict(self._conversations.get(name, {}))
+
+    # --- Запись ---
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        conversation = self._conversations.setdefault(name, {})
+        if conversation.get(key) == new_state:
+            return
+        if new_state is None:
+            conversation.pop(key, None)
+            self._mark(f"conv:{name}", json.dumps(list(key)), _DELETED)
+        else:
+            conversation[key] = new_state
+            self._mark(f"conv:{name}", json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if self._user_data.get(user_id) == data:
+            return
+        self._user_data[user_id] = copy.deepcopy(data)
+        self._mark('user', user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        if self._chat_data.get(chat_id) == data:
+            return
+        self._chat_data[chat_id] = copy.deepcopy(data)
+        self._mark('chat', chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        if self._bot_data == data:
+            return
+        self._bot_data = copy.deepcopy(data)
+        self._mark('bot', 0, data)
+
+    async def update_callback_data(self, data) -> None:
+        if self._callback_data == data:
+            return
+        self._callback_data = copy.deepcopy(data)
+        self._mark('callback', 0, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._user_data.pop(user_id, None)
+        self._mark('user', user_id, _DELETED)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._chat_data.pop(chat_id, None)
+        self._mark('chat', chat_id, _DELETED)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        # Данные меняет только этот процесс, обновлять из файла нечего
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Записывает всё несохранённое немедленно (вызывается при остановке бота)."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        logger.info("💾 Состояние бота сохранено.")
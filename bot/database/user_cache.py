@@ -0,0 +1,157 @@
+# bot/database/user_cache.py
+import os
+import copy
+import time
+import logging
+from collections import OrderedDict
+from bot.database.core import get_supabase, execute
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# Сколько user_id передаём в одном фильтре in_ (ограничение длины URL PostgREST)
+IN_FILTER_CHUNK = 500
+
+# Поля профиля, которые читают обработчики. Читаем их все одним запросом,
+# чтобы любое следующее обращение к профилю попадало в кэш.
+PROFILE_COLUMNS = (
+    'user_id, username, first_name, last_name, is_banned, banned_features, '
+    'can_receive_broadcast, is_in_squad, is_in_city, last_anketa_time, last_appeal_time, unreachable_at'
+)
+
+
+class UserCache:
+    """LRU-кэш профилей пользователей с ограниченным временем жизни записей."""
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # user_id -> (expires_at, row)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        """Возвращает копию профиля или None, если его нет в кэше или он устарел."""
+        entry = self._data.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, user_id: int, row: dict) -> None:
+        self._data[user_id] = (time.monotonic() + self.ttl, copy.deepcopy(row))
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def update(self, user_id: int, fields: dict) -> None:
+        """Применяет записанные в БД поля к закэшированному профилю (write-through)."""
+        entry = self._data.get(user_id)
+        if entry is not None:
+            entry[1].update(copy.deepcopy(fields))
+
+    def invalidate(self, user_id: int) -> None:
+        self._data.pop(user_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+user_cache = UserCache()
+
+
+async def get_user_profile(user_id: int):
+    """Возвращает профиль пользователя из кэша или из БД. None — пользователя нет в базе."""
+    row = user_cache.get(user_id)
+    if row is not None:
+        return row
+    supabase = get_supabase()
+    response = await execute(supabase.table('users').select(PROFILE_COLUMNS).eq('user_id', user_id))
+    if not response.data:
+        return None
+    row = response.data[0]
+    user_cache.set(user_id, row)
+    return copy.deepcopy(row)
+
+
+async def update_user(user_id: int, fields: dict):
+    """Обновляет пользователя в БД и в кэше. Возвращает ответ PostgREST."""
+    supabase = get_supabase()
+    response = await execute(supabase.table('users').update(fields).eq('user_id', user_id))
+    user_cache.update(user_id, fields)
+    return response
+
+
+async def update_users(user_ids: list, fields: dict) -> set:
+    """Обновляет сразу многих пользователей (фильтр in_) в БД и в кэше.
+
+    Возвращает множество user_id, которые нашлись в базе.
+    """
+    supabase = get_supabase()
+    updated = set()
+    for start in range(0, len(user_ids), IN_FILTER_CHUNK):
+        chunk = user_ids[start:start + IN_FILTER_CHUNK]
+        response = await execute(supabase.table('users').update(fields).in_('user_id', chunk))
+        for row in response.data or []:
+            updated.add(row['user_id'])
+            user_cache.update(row['user_id'], fields)
+    return updated
+
+
+async def _call_user_rpc(function: str, user_id: int, field: str, params: dict = None):
+    """Вызывает RPC, атомарно меняющую одно поле пользователя, и обновляет кэш.
+
+    Возвращает новое значение поля или None, если пользователя нет в базе.
+    """
+    supabase = get_supabase()
+    response = await execute(supabase.rpc(function, {'p_user_id': user_id, **(params or {})}))
+    value = response.data
+    if value is None:
+        return None
+    user_cache.update(user_id, {field: value})
+    return value
+
+
+async def add_banned_feature(user_ids: list, feature: str) -> set:
+    """Добавляет ограничение в banned_features пользователям (если его ещё нет).
+
+    Возвращает множество user_id, которые нашлись в базе.
+    """
+    supabase = get_supabase()
+    updated = set()
+    for start in range(0, len(user_ids), IN_FILTER_CHUNK):
+        chunk = user_ids[start:start + IN_FILTER_CHUNK]
+        response = await execute(supabase.rpc('add_banned_feature_bulk', {'p_user_ids': chunk, 'p_feature': feature}))
+        for row in response.data or []:
+            updated.add(row['user_id'])
+            user_cache.update(row['user_id'], {'banned_features': row['banned_features']})
+    return updated
+
+
+async def remove_banned_feature(user_id: int, feature: str):
+    """Убирает ограничение из banned_features. Возвращает новый список."""
+    return await _call_user_rpc('remove_banned_feature', user_id, 'banned_features', {'p_feature': feature})
+
+
+async def toggle_broadcast(user_id: int):
+    """Переключает can_receive_broadcast. Возвращает новое значение."""
+    return await _call_user_rpc('toggle_broadcast', user_id, 'can_receive_broadcast')
+
+
+async def search_users(query: str, limit: int = 10) -> list:
+    """Ищет пользователей по подстроке username/имени/фамилии или началу user_id (RPC search_users)."""
+    supabase = get_supabase()
+    response = await execute(supabase.rpc('search_users', {'p_query': query, 'p_limit': limit}))
+    return response.data or []
@@ -0,0 +1,118 @@
+# bot/database/username_index.py
+import re
+import asyncio
+import logging
+from bot.database.core import get_supabase, execute
+
+logger = logging.getLogger(__name__)
+
+# Сколько username искать одним запросом: условия or=(...) идут в URL
+USERNAME_LOOKUP_CHUNK = 100
+
+# Допустимый username Telegram; всё остальное в БД не ищем
+VALID_USERNAME = re.compile(r'^[A-Za-z0-9_]{3,32}$')
+
+
+class UsernameIndex:
+    """Индекс username -> user_id без учёта регистра.
+
+    Пополняется из таблицы users при старте и из effective_user каждого
+    обновления, поэтому поиск по @username обычно не требует запроса к БД.
+    """
+
+    def __init__(self):
+        self._ids = {}        # username в нижнем регистре -> user_id
+        self._usernames = {}  # user_id -> username в нижнем регистре
+
+    @staticmethod
+    def _normalize(username: str) -> str:
+        return username.lstrip('@').lower()
+
+    def set(self, user_id: int, username: str) -> None:
+        """Запоминает текущий username пользователя (None — username нет)."""
+        key = self._normalize(username) if username else None
+        old = self._usernames.get(user_id)
+        if old == key:
+            return
+        if old is not None and self._ids.get(old) == user_id:
+            del self._ids[old]
+        if key is None:
+            self._usernames.pop(user_id, None)
+            return
+        # Username мог раньше принадлежать другому пользователю
+        previous_owner = self._ids.get(key)
+        if previous_owner is not None and previous_owner != user_id:
+            self._usernames.pop(previous_owner, None)
+        self._ids[key] = user_id
+        self._usernames[user_id] = key
+
+    def setdefault(self, user_id: int, username: str) -> None:
+        """Как set, но не затирает уже известные данные (они свежее данных из БД)."""
+        if user_id in self._usernames or not username or self.get(username) is not None:
+            return
+        self.set(user_id, username)
+
+    def get(self, username: str):
+        return self._ids.get(self._normalize(username))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+username_index = UsernameIndex()
+
+
+def _escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE (в username часто встречается «_»)."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+async def resolve_username(username: str):
+    """Возвращает user_id по username (с @ или без) или None."""
+    username = username.lstrip('@')
+    user_id = username_index.get(username)
+    if user_id is not None:
+        return user_id
+    # Пользователя ещё нет в индексе — ищем в БД без учёта регистра
+    supabase = get_supabase()
+    response = await execute(
+        supabase.table('users').select('user_id, username').ilike('username', _escape_like(username)).limit(1)
+    )
+    if not response.data:
+        return None
+    row = response.data[0]
+    username_index.set(row['user_id'], row['username'])
+    return row['user_id']
+
+
+async def _lookup_usernames(usernames: list) -> list:
+    """Строки users, username которых совпадает с одним из usernames без учёта регистра."""
+    # «_» в ilike — любой символ, поэтому лишние совпадения отсеиваются ниже
+    conditions = ','.join(f'username.ilike.{username}' for username in usernames)
+    response = await execute(get_supabase().table('users').select('user_id, username').or_(conditions))
+    wanted = {username.lower() for username in usernames}
+    return [row for row in response.data or [] if row['username'] and row['username'].lower() in wanted]
+
+
+async def resolve_usernames(usernames: list) -> dict:
+    """Находит user_id сразу для многих username (с @ или без).
+
+    Возвращает {username в нижнем регистре: user_id} для найденных. Чего нет
+    в индексе, ищется в БД без учёта регистра, по USERNAME_LOOKUP_CHUNK за запрос.
+    """
+    result = {}
+    missing = {}
+    for username in usernames:
+        username = username.lstrip('@')
+        user_id = username_index.get(username)
+        if user_id is not None:
+            result[username.lower()] = user_id
+        elif VALID_USERNAME.match(username):
+            missing[username.lower()] = username
+    names = list(missing)
+    chunks = [names[i:i + USERNAME_LOOKUP_CHUNK] for i in range(0, len(names), USERNAME_LOOKUP_CHUNK)]
+    for rows in await asyncio.gather(*(_lookup_usernames(chunk) for chunk in chunks)):
+        for row in rows:
+            username_index.set(row['user_id'], row['username'])
+            result[row['username'].lower()] = row['user_id']
+    return result
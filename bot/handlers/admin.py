@@ -1,9 +1,21 @@
 # bot/handlers/admin.py
 import os
+import re
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone
-from telegram import Update
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from bot.database.core import get_supabase
+from bot.database.user_cache import search_users, update_user, update_users, user_cache, add_banned_feature, remove_banned_feature
+from bot.database.pagination import fetch_page
+from bot.database.username_index import resolve_username, resolve_usernames, username_index
+from bot.services.antiflood import flood_guard
+from bot.services.bans import ban_registry
+from bot.services.broadcast_engine import limiter
+from bot.services.export import export_users, EXPORT_FORMATS
+from bot.services.stats import format_stats
+from bot.services import segments
 
 def get_admin_ids() -> list:
     """Возвращает список ID администраторов."""
@@ -79,68 +91,255 @@ def format_banned_user_list(users: list) -> str:
     return "📋 *Заблокированные пользователи:*\n" + "\n".join(lines)
 
 async def _get_user_id_by_username(username: str) -> int:
-    """Получает user_id по username (без @)."""
-    if username.startswith('@'):
-        username = username[1:]
-    supabase = get_supabase()
-    response = supabase.table('users').select('user_id').eq('username', username).execute()
-    # ИСПРАВЛЕНО: проверка .data
-    if response.data:
-        return response.data[0]['user_id']
-    return None
+    """Получает user_id по username (с @ или без, без учёта регистра)."""
+    return await resolve_username(username)
+
+async def track_username(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обновляет индекс username по автору каждого входящего обновления."""
+    user = update.effective_user
+    if user:
+        username_index.set(user.id, user.username)
+
+# --- Постраничные списки пользователей ---
+
+ROSTER_PAGE_SIZE = int(os.getenv("ROSTER_PAGE_SIZE", "25"))
+# Сколько секунд показанная страница переиспользуется при навигации кнопками
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", "30"))
+ROSTER_CACHE_SIZE = 200
+
+USER_LIST_COLUMNS = 'user_id, username, first_name, last_name, created_at'
+
+SUBSCRIBER_STATUS_EMOJI = {'receiving': "🔔", 'opted_out': "🔕", 'unreachable': "📵", 'banned': "❌"}
+
+def format_subscriber_list(users: list) -> str:
+    """Форматирует список пользователей со статусом подписки на рассылки."""
+    if not users:
+        return "Список пользователей пуст."
+
+    lines = []
+    for user in users:
+        name = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+        if not name:
+            name = "Без имени"
+        username = f"@{user['username']}" if user.get('username') else "—"
+
+        emoji = SUBSCRIBER_STATUS_EMOJI[segments.subscriber_status(user)]
+        lines.append(f"{emoji} {name} 🐜 {username} (ID: {user['user_id']})")
+
+    return "📬 *Подписчики рассылок* (🔔 получают, 🔕 отключили, 📵 недоступны, ❌ заблокированы):\n" + "\n".join(lines)
+
+# Списки: столбцы, фильтр, форматирование страницы и режим разметки
+ROSTER_VIEWS = {
+    'all': {
+        'columns': USER_LIST_COLUMNS,
+        'filters': None,
+        'format': lambda users: format_user_list(users, "Список всех пользователей", squad_or_city=False),
+        'parse_mode': None,
+    },
+    'squad': {
+        'columns': USER_LIST_COLUMNS,
+        'filters': lambda q: q.eq('is_in_squad', True),
+        'format': lambda users: format_user_list(users, "Участники сквада", squad_or_city=True),
+        'parse_mode': None,
+    },
+    'city': {
+        'columns': USER_LIST_COLUMNS,
+        'filters': lambda q: q.eq('is_in_city', True),
+        'format': lambda users: format_user_list(users, "Участники города", squad_or_city=True),
+        'parse_mode': None,
+    },
+    'banned': {
+        'columns': 'user_id, username, first_name, last_name, is_banned, banned_features',
+        'filters': segments.banned,
+        'format': format_banned_user_list,
+        'parse_mode': "Markdown",
+    },
+    'subscribers': {
+        'columns': 'user_id, username, first_name, last_name, can_receive_broadcast, is_banned, banned_features, unreachable_at',
+        'filters': None,
+        'format': format_subscriber_list,
+        'parse_mode': "Markdown",
+    },
+}
+
+# (view, направление, курсор) -> (истекает, (text, reply_markup))
+_roster_cache = OrderedDict()
+
+async def _render_roster_page(view: str, direction: str = 's', cursor: int = None, use_cache: bool = True) -> tuple:
+    """Возвращает (text, reply_markup) страницы списка.
+
+    direction: 's' — первая страница, 'n' — после cursor, 'p' — перед cursor.
+    Страницы идут по возрастанию user_id и запрашиваются по одной (keyset).
+    """
+    cache_key = (view, direction, cursor)
+    entry = _roster_cache.get(cache_key)
+    if use_cache and entry is not None and entry[0] > time.monotonic():
+        _roster_cache.move_to_end(cache_key)
+        return entry[1]
+
+    config = ROSTER_VIEWS[view]
+    rows, has_more = await fetch_page(
+        'users', config['columns'], config['filters'],
+        after=cursor if direction == 'n' else None,
+        before=cursor if direction == 'p' else None,
+        page_size=ROSTER_PAGE_SIZE,
+    )
+    if direction == 'p':
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = direction == 'n', has_more
+
+    buttons = []
+    if rows and has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"roster:{view}:p:{rows[0]['user_id']}"))
+    if rows and has_next:
+        buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"roster:{view}:n:{rows[-1]['user_id']}"))
+    page = (config['format'](rows), InlineKeyboardMarkup([buttons]) if buttons else None)
+
+    _roster_cache[cache_key] = (time.monotonic() + ROSTER_CACHE_TTL, page)
+    _roster_cache.move_to_end(cache_key)
+    while len(_roster_cache) > ROSTER_CACHE_SIZE:
+        _roster_cache.popitem(last=False)
+    return page
+
+async def show_roster(update: Update, view: str) -> None:
+    """Отправляет первую страницу списка (всегда свежую, без кэша)."""
+    text, reply_markup = await _render_roster_page(view, use_cache=False)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ROSTER_VIEWS[view]['parse_mode'])
+
+async def roster_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листает список по кнопкам «Назад»/«Вперёд»."""
+    query = update.callback_query
+    if update.effective_user.id not in get_admin_ids():
+        await query.answer()
+        return
+
+    try:
+        _, view, direction, cursor = query.data.split(':')
+        cursor = int(cursor)
+    except ValueError:
+        await query.answer()
+        return
+    if view not in ROSTER_VIEWS or direction not in ('n', 'p'):
+        await query.answer()
+        return
+
+    await query.answer()
+    text, reply_markup = await _render_roster_page(view, direction, cursor)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ROSTER_VIEWS[view]['parse_mode'])
+    except BadRequest as e:
+        # Повторное нажатие на ту же кнопку: содержимое не изменилось
+        if "not modified" not in str(e):
+            raise
 
 async def list_all_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает всех пользователей."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    supabase = get_supabase()
-    response = supabase.table('users').select('user_id, username, first_name, last_name, created_at').order('created_at', desc=True).execute()
-    users = response.data or []
-
-    text = format_user_list(users, "Список всех пользователей", squad_or_city=False)
-    await update.message.reply_text(text)
+    await show_roster(update, 'all')
 
 async def list_squad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает участников сквада."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    supabase = get_supabase()
-    response = supabase.table('users').select('user_id, username, first_name, last_name, created_at').eq('is_in_squad', True).order('created_at', desc=True).execute()
-    users = response.data or []
-
-    text = format_user_list(users, "Участники сквада", squad_or_city=True)
-    await update.message.reply_text(text)
+    await show_roster(update, 'squad')
 
 async def list_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает участников города."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    supabase = get_supabase()
-    response = supabase.table('users').select('user_id, username, first_name, last_name, created_at').eq('is_in_city', True).order('created_at', desc=True).execute()
-    users = response.data or []
-
-    text = format_user_list(users, "Участники города", squad_or_city=True)
-    await update.message.reply_text(text)
+    await show_roster(update, 'city')
 
 async def list_banned_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает всех заблокированных пользователей."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    supabase = get_supabase()
-    # Выбираем пользователей с is_banned = True или banned_features, содержащими 'all'
-    response = supabase.table('users').select('user_id, username, first_name, last_name, is_banned, banned_features').or_('is_banned.eq.true,banned_features.cs.{all}').order('created_at', desc=True).execute()
-    users = response.data or []
+    await show_roster(update, 'banned')
+
+# Фильтры выгрузки /export
+EXPORT_SEGMENTS = {
+    'all': None,
+    'squad': ROSTER_VIEWS['squad']['filters'],
+    'city': ROSTER_VIEWS['city']['filters'],
+    'banned': ROSTER_VIEWS['banned']['filters'],
+    'subscribers': segments.receiving,
+}
+
+async def export_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выгружает пользователей файлом: /export [all|squad|city|banned|subscribers] [csv|jsonl]."""
+    if update.effective_user.id not in get_admin_ids():
+        return
+
+    args = [arg.lower() for arg in context.args]
+    segment = next((arg for arg in args if arg in EXPORT_SEGMENTS), 'all')
+    fmt = next((arg for arg in args if arg in EXPORT_FORMATS), 'csv')
+    if any(arg not in EXPORT_SEGMENTS and arg not in EXPORT_FORMATS for arg in args):
+        await update.message.reply_text("📌 Использование: /export [all|squad|city|banned|subscribers] [csv|jsonl]")
+        return
+
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+    file, filename, count = await export_users(EXPORT_SEGMENTS[segment], fmt, name=f"users_{segment}")
+    try:
+        await update.message.reply_document(document=file, filename=filename, caption=f"📤 Пользователи ({segment}): {count}")
+    finally:
+        file.close()
 
+# Сколько результатов показывает /find
+FIND_LIMIT = 10
+
+def format_search_results(users: list, query: str) -> str:
+    """Форматирует результаты /find: имя, username, ID, сквад/город и блокировки."""
     if not users:
-        await update.message.reply_text("Список заблокированных пользователей пуст.")
+        return f"🔍 По запросу «{query}» никого не найдено."
+
+    lines = []
+    for user in users:
+        name = f"{user.get('first_name') or ''} {user.get('last_name') or ''}".strip()
+        if not name:
+            name = "Без имени"
+        username = f"@{user['username']}" if user.get('username') else "—"
+
+        groups = []
+        if user.get('is_in_squad'):
+            groups.append("сквад")
+        if user.get('is_in_city'):
+            groups.append("город")
+        banned_features = user.get('banned_features') or []
+        if user.get('is_banned') or 'all' in banned_features:
+            status = "❌ заблокирован"
+        elif banned_features:
+            status = "⛔ ограничен: " + ", ".join(banned_features)
+        else:
+            status = "✅"
+
+        lines.append(f"🔘 {name} 🐜 {username} (ID: {user['user_id']}) — {', '.join(groups) or 'без группы'} | {status}")
+
+    return f"🔍 Найдено по запросу «{query}» ({len(users)}):\n" + "\n".join(lines)
+
+async def find_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ищет пользователей по имени, username или началу user_id."""
+    if update.effective_user.id not in get_admin_ids():
+        return
+
+    query = " ".join(context.args).strip()
+    if len(query.lstrip('@')) < 2:
+        await update.message.reply_text("📌 Использование: /find <имя, @username или начало user_id> (не короче 2 символов)")
+        return
+
+    users = await search_users(query, FIND_LIMIT)
+    await update.message.reply_text(format_search_results(users, query))
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает число пользователей по группам (без загрузки самих пользователей)."""
+    if update.effective_user.id not in get_admin_ids():
         return
 
-    text = format_banned_user_list(users)
-    await update.message.reply_text(text, parse_mode="Markdown")
+    await update.message.reply_text(await format_stats(), parse_mode="Markdown")
 
 async def note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает список всех команд бота."""
@@ -154,13 +353,13 @@ async def note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 /list_squad - Список участников сквада
 /list_city - Список участников города
 /list_banned - Список заблокированных пользователей
-/add_to_squad - Добавить в сквад
-/add_to_city - Добавить в город
-/remove_from_squad - Удалить из сквада
-/remove_from_city - Удалить из города
-/ban - Заблокировать пользователя
+/add_to_squad - Добавить в сквад (можно списком или CSV)
+/add_to_city - Добавить в город (можно списком или CSV)
+/remove_from_squad - Удалить из сквада (можно списком)
+/remove_from_city - Удалить из города (можно списком)
+/ban - Заблокировать пользователей (можно списком)
 /unban - Разблокировать пользователя
-/restrict - Ограничить функцию
+/restrict - Ограничить функцию (можно списком)
 /unrestrict - Снять ограничение
 /broadcast_all - Рассылка всем
 /broadcast_squad - Рассылка скваду
@@ -168,179 +367,202 @@ async def note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 /broadcast_starly - Рассылка Старли
 /broadcast_to_user - Рассылка пользователю
 /broadcast_to_group - Рассылка в чат
-/list_subscribers - Список подписчиков рассылок
+/broadcast_pause - Поставить рассылку на паузу
+/broadcast_resume - Продолжить рассылку
+/broadcast_cancel - Отменить рассылку
+/list_subscribers - Сводка по подписчикам рассылок (list — список)
+/stats - Статистика пользователей
+/find - Найти пользователя по имени, username или ID
+/export - Выгрузить пользователей файлом (CSV/JSONL)
+/cache_stats - Статистика кэша профилей и обработки обновлений
 /note - Показать этот список
     """
     await update.message.reply_text(f"📋 *Список команд:*\n{commands}", parse_mode="Markdown")
 
-async def add_to_squad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Добавляет пользователя в сквад по @username или user_id."""
-    if update.effective_user.id not in get_admin_ids():
-        return
-
-    if not context.args:
-        await update.message.reply_text("📌 Использование: /add_to_squad <@username или user_id>")
-        return
-
-    identifier = context.args[0]
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
+# --- Массовые команды: несколько @username/user_id, ответ на список или CSV-файл ---
+
+# Упоминания пользователей в тексте сообщения или файла: @username или числовой user_id
+IDENTIFIER_PATTERN = re.compile(r'@[A-Za-z0-9_]{3,32}|\b\d{5,}\b')
+# Один идентификатор целиком (для проверки, что сообщение — именно список)
+IDENTIFIER_TOKEN = re.compile(r'@[A-Za-z0-9_]{3,32}|\d{5,}')
+# Разделители идентификаторов в аргументах и в списке
+IDENTIFIER_SEPARATORS = re.compile(r'[\s,;]+')
+# Максимальный размер файла со списком пользователей
+MAX_IMPORT_FILE_SIZE = 1024 * 1024
+# Файлы, которые считаются списком пользователей
+LIST_FILE_EXTENSIONS = ('.csv', '.txt')
+LIST_MIME_TYPES = ('text/csv', 'text/plain')
+
+def _split_identifiers(text: str) -> list:
+    return [token for token in IDENTIFIER_SEPARATORS.split(text) if token]
+
+def _is_list_document(document) -> bool:
+    file_name = (document.file_name or '').lower()
+    return file_name.endswith(LIST_FILE_EXTENSIONS) or document.mime_type in LIST_MIME_TYPES
+
+async def _collect_identifiers(update: Update, context: ContextTypes.DEFAULT_TYPE, args: list) -> list:
+    """Собирает идентификаторы из аргументов команды или из сообщения, на которое ответили.
+
+    Аргументы можно разделять пробелами, запятыми или точкой с запятой. Если
+    аргументов нет, берётся ответ: документ CSV/TXT (из него — все @username и
+    числовые user_id) или сообщение, состоящее только из идентификаторов.
+    Пересланную анкету или любое другое сообщение списком не считаем, чтобы
+    случайно не задеть упомянутых в нём людей.
+    """
+    identifiers = []
+    for arg in args:
+        identifiers.extend(_split_identifiers(arg))
+
+    reply = update.message.reply_to_message
+    if not identifiers and reply:
+        if reply.document:
+            if _is_list_document(reply.document) and (reply.document.file_size or 0) <= MAX_IMPORT_FILE_SIZE:
+                file = await reply.document.get_file()
+                data = await file.download_as_bytearray()
+                identifiers = IDENTIFIER_PATTERN.findall(bytes(data).decode('utf-8', errors='ignore'))
+        else:
+            tokens = _split_identifiers(reply.text or '')
+            if tokens and all(IDENTIFIER_TOKEN.fullmatch(token) for token in tokens):
+                identifiers = tokens
+
+    # Убираем повторы, сохраняя порядок
+    return list(dict.fromkeys(identifiers))
+
+async def _resolve_identifiers(identifiers: list) -> tuple:
+    """Возвращает ({user_id: identifier}, [идентификаторы, которые не удалось распознать])."""
+    usernames = await resolve_usernames([i for i in identifiers if i.startswith('@')])
+    resolved = {}
+    unknown = []
+    for identifier in identifiers:
+        if identifier.startswith('@'):
+            user_id = usernames.get(identifier[1:].lower())
+        elif identifier.isdigit():
             user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
+        else:
+            user_id = None
+        if user_id is None:
+            unknown.append(identifier)
+        else:
+            resolved.setdefault(user_id, identifier)
+    return resolved, unknown
+
+def _bulk_summary(done: list, missing: list, single_text: str, bulk_title: str) -> str:
+    """Один ответ админу по итогам массовой команды."""
+    if len(done) + len(missing) == 1:
+        if done:
+            return single_text.format(identifier=done[0])
+        return f"❌ Пользователь {missing[0]} не найден в базе."
+    lines = [f"✅ {bulk_title}: {len(done)}"]
+    if done:
+        lines.append(", ".join(done))
+    if missing:
+        lines.append(f"❌ Не найдены ({len(missing)}): " + ", ".join(missing))
+    return "\n".join(lines)
+
+async def _apply_to_users(update: Update, context: ContextTypes.DEFAULT_TYPE, args: list, usage: str, apply,
+                          single_text: str, bulk_title: str) -> list:
+    """Общая часть массовых команд: собрать список, найти всех разом, применить apply.
+
+    apply(user_ids) выполняет изменение одним запросом и возвращает множество
+    найденных в базе user_id. Возвращает список изменённых user_id.
+    """
+    identifiers = await _collect_identifiers(update, context, args)
+    if not identifiers:
+        await update.message.reply_text(usage)
+        return []
 
-    supabase = get_supabase()
-    existing = supabase.table('users').select('user_id').eq('user_id', user_id).execute()
-    # ИСПРАВЛЕНО: проверка .data
-    if not existing.data:
-        await update.message.reply_text("❌ Пользователь не найден в базе.")
-        return
+    resolved, missing = await _resolve_identifiers(identifiers)
+    updated = await apply(list(resolved)) if resolved else set()
+    done = [identifier for user_id, identifier in resolved.items() if user_id in updated]
+    missing += [identifier for user_id, identifier in resolved.items() if user_id not in updated]
 
-    supabase.table('users').update({
-        'is_in_squad': True,
-        'is_in_city': False
-    }).eq('user_id', user_id).execute()
-    await update.message.reply_text(f"✅ Пользователь {identifier} добавлен в сквад и удалён из города.")
+    await update.message.reply_text(_bulk_summary(done, missing, single_text, bulk_title))
+    return [user_id for user_id in resolved if user_id in updated]
 
-async def add_to_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Добавляет пользователя в город по @username или user_id."""
+def _set_fields(fields: dict):
+    async def apply(user_ids: list) -> set:
+        return await update_users(user_ids, fields)
+    return apply
+
+async def add_to_squad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Добавляет пользователей в сквад по @username или user_id (можно списком)."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    if not context.args:
-        await update.message.reply_text("📌 Использование: /add_to_city <@username или user_id>")
-        return
+    await _apply_to_users(
+        update, context, context.args,
+        "📌 Использование: /add_to_squad <@username или user_id ...> (или ответом на список/CSV)",
+        _set_fields({'is_in_squad': True, 'is_in_city': False}),
+        "✅ Пользователь {identifier} добавлен в сквад и удалён из города.",
+        "Добавлены в сквад и удалены из города",
+    )
 
-    identifier = context.args[0]
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
-            user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
-
-    supabase = get_supabase()
-    existing = supabase.table('users').select('user_id').eq('user_id', user_id).execute()
-    # ИСПРАВЛЕНО: проверка .data
-    if not existing.data:
-        await update.message.reply_text("❌ Пользователь не найден в базе.")
+async def add_to_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Добавляет пользователей в город по @username или user_id (можно списком)."""
+    if update.effective_user.id not in get_admin_ids():
         return
 
-    supabase.table('users').update({
-        'is_in_city': True,
-        'is_in_squad': False
-    }).eq('user_id', user_id).execute()
-    await update.message.reply_text(f"✅ Пользователь {identifier} добавлен в город и удалён из сквада.")
+    await _apply_to_users(
+        update, context, context.args,
+        "📌 Использование: /add_to_city <@username или user_id ...> (или ответом на список/CSV)",
+        _set_fields({'is_in_city': True, 'is_in_squad': False}),
+        "✅ Пользователь {identifier} добавлен в город и удалён из сквада.",
+        "Добавлены в город и удалены из сквада",
+    )
 
 async def remove_from_squad(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Удаляет пользователя из сквада по @username или user_id."""
+    """Удаляет пользователей из сквада по @username или user_id (можно списком)."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    if not context.args:
-        await update.message.reply_text("📌 Использование: /remove_from_squad <@username или user_id>")
-        return
-
-    identifier = context.args[0]
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
-            user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
-
-    supabase = get_supabase()
-    supabase.table('users').update({'is_in_squad': False}).eq('user_id', user_id).execute()
-    await update.message.reply_text(f"✅ Пользователь {identifier} удалён из сквада.")
+    await _apply_to_users(
+        update, context, context.args,
+        "📌 Использование: /remove_from_squad <@username или user_id ...> (или ответом на список/CSV)",
+        _set_fields({'is_in_squad': False}),
+        "✅ Пользователь {identifier} удалён из сквада.",
+        "Удалены из сквада",
+    )
 
 async def remove_from_city(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Удаляет пользователя из города по @username или user_id."""
+    """Удаляет пользователей из города по @username или user_id (можно списком)."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    if not context.args:
-        await update.message.reply_text("📌 Использование: /remove_from_city <@username или user_id>")
-        return
-
-    identifier = context.args[0]
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
-            user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
-
-    supabase = get_supabase()
-    supabase.table('users').update({'is_in_city': False}).eq('user_id', user_id).execute()
-    await update.message.reply_text(f"✅ Пользователь {identifier} удалён из города.")
+    await _apply_to_users(
+        update, context, context.args,
+        "📌 Использование: /remove_from_city <@username или user_id ...> (или ответом на список/CSV)",
+        _set_fields({'is_in_city': False}),
+        "✅ Пользователь {identifier} удалён из города.",
+        "Удалены из города",
+    )
 
 # === ФУНКЦИИ БАНА ===
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Блокирует пользователя полностью."""
+    """Блокирует пользователей полностью (можно списком)."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    if not context.args:
-        await update.message.reply_text("📌 Использование: /ban <@username или user_id>")
-        return
-
-    identifier = context.args[0]
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
-            user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
+    banned = await _apply_to_users(
+        update, context, context.args,
+        "📌 Использование: /ban <@username или user_id ...> (или ответом на список/CSV)",
+        _set_fields({'is_banned': True, 'banned_features': ['all']}),
+        "✅ Пользователь {identifier} заблокирован полностью.",
+        "Заблокированы полностью",
+    )
 
-    supabase = get_supabase()
-    supabase.table('users').update({
-        'is_banned': True,
-        'banned_features': ['all']
-    }).eq('user_id', user_id).execute()
-    
-    # --- ДОБАВЛЕНО: Отправка уведомления ---
-    try:
-        await context.bot.send_message(chat_id=user_id, text="❌ Вы были заблокированы администратором.")
-        # Попробовать отправить основное меню, если возможно
-        from telegram import ReplyKeyboardRemove
-        await context.bot.send_message(chat_id=user_id, text="❌ Вы заблокированы и не можете пользоваться ботом.", reply_markup=ReplyKeyboardRemove())
-    except Exception as e:
-        # logger.warning(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
-        pass # Или логировать, если нужно
-    # --- КОНЕЦ ДОБАВЛЕНИЯ ---
+    for user_id in banned:
+        ban_registry.ban(user_id)
 
-    await update.message.reply_text(f"✅ Пользователь {identifier} заблокирован полностью.")
+    # Уведомляем заблокированных с учётом общего лимита отправки бота
+    from telegram import ReplyKeyboardRemove
+    for user_id in banned:
+        try:
+            await limiter.acquire(user_id)
+            await context.bot.send_message(chat_id=user_id, text="❌ Вы были заблокированы администратором.")
+            await context.bot.send_message(chat_id=user_id, text="❌ Вы заблокированы и не можете пользоваться ботом.", reply_markup=ReplyKeyboardRemove())
+        except Exception as e:
+            # Пользователь мог заблокировать бота — это не мешает бану
+            pass
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Разблокирует пользователя."""
@@ -365,11 +587,11 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
             return
 
-    supabase = get_supabase()
-    supabase.table('users').update({
+    await update_user(user_id, {
         'is_banned': False,
         'banned_features': []
-    }).eq('user_id', user_id).execute()
+    })
+    ban_registry.unban(user_id)
 
     # --- ДОБАВЛЕНО: Отправка уведомления ---
     try:
@@ -390,49 +612,34 @@ async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     await update.message.reply_text(f"✅ Пользователь {identifier} разблокирован.")
 
 async def restrict_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Ограничивает пользователя (например, анкеты или обращения)."""
+    """Ограничивает пользователей (например, анкеты или обращения), можно списком."""
     if update.effective_user.id not in get_admin_ids():
         return
 
-    if len(context.args) < 2:
-        await update.message.reply_text("📌 Использование: /restrict <@username или user_id> <anketa|appeal>")
+    usage = "📌 Использование: /restrict <@username или user_id ...> <anketa|appeal> (или ответом на список/CSV)"
+    if not context.args:
+        await update.message.reply_text(usage)
         return
 
-    identifier = context.args[0]
-    restriction = context.args[1].lower()
+    # Ограничение — последний аргумент, перед ним идут пользователи
+    restriction = context.args[-1].lower()
     
     if restriction not in ['anketa', 'appeal']:
         await update.message.reply_text("❌ Допустимые ограничения: anketa, appeal")
         return
 
-    user_id = None
-    if identifier.startswith('@'):
-        user_id = await _get_user_id_by_username(identifier)
-        if not user_id:
-            await update.message.reply_text(f"❌ Пользователь {identifier} не найден в базе.")
-            return
-    else:
-        try:
-            user_id = int(identifier)
-        except ValueError:
-            await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
-            return
+    async def apply(user_ids: list) -> set:
+        # Ограничение добавляется на стороне БД одним атомарным запросом
+        updated = await add_banned_feature(user_ids, restriction)
+        for user_id in updated:
+            ban_registry.restrict(user_id, restriction)
+        return updated
 
-    supabase = get_supabase()
-    # Получаем текущие ограничения
-    response = supabase.table('users').select('banned_features').eq('user_id', user_id).execute()
-    # ИСПРАВЛЕНО: проверка .data
-    if response.data:
-        current_bans = response.data[0].get('banned_features', [])
-        if restriction not in current_bans:
-            current_bans.append(restriction)
-        
-        supabase.table('users').update({
-            'banned_features': current_bans
-        }).eq('user_id', user_id).execute()
-        await update.message.reply_text(f"✅ Пользователь {identifier} ограничен: {restriction}")
-    else:
-        await update.message.reply_text("❌ Пользователь не найден в базе.")
+    await _apply_to_users(
+        update, context, context.args[:-1], usage, apply,
+        "✅ Пользователь {identifier} ограничен: " + restriction,
+        f"Ограничены ({restriction})",
+    )
 
 async def unrestrict_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Снимает ограничения с пользователя."""
@@ -463,18 +670,36 @@ async def unrestrict_user(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text("❌ user_id должен быть числом, а username — начинаться с @.")
             return
 
-    supabase = get_supabase()
-    # Получаем текущие ограничения
-    response = supabase.table('users').select('banned_features').eq('user_id', user_id).execute()
-    # ИСПРАВЛЕНО: проверка .data
-    if response.data:
-        current_bans = response.data[0].get('banned_features', [])
-        if restriction in current_bans:
-            current_bans.remove(restriction)
-        
-        supabase.table('users').update({
-            'banned_features': current_bans
-        }).eq('user_id', user_id).execute()
+    # Ограничение снимается на стороне БД одним атомарным запросом
+    if await remove_banned_feature(user_id, restriction) is not None:
+        ban_registry.unrestrict(user_id, restriction)
         await update.message.reply_text(f"✅ С пользователя {identifier} снято ограничение: {restriction}")
     else:
         await update.message.reply_text("❌ Пользователь не найден в базе.")
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показывает статистику кэша профилей и обработки обновлений."""
+    if update.effective_user.id not in get_admin_ids():
+        return
+
+    stats = user_cache.stats()
+    text = (
+        f"🗃️ Кэш профилей\n"
+        f"📦 Записей: {stats['size']}\n"
+        f"✅ Попаданий: {stats['hits']}\n"
+        f"❌ Промахов: {stats['misses']}\n"
+        f"🎯 Доля попаданий: {stats['hit_rate']:.0%}"
+    )
+
+    processor = context.application.update_processor
+    if hasattr(processor, 'stats'):
+        updates = processor.stats()
+        text += (
+            f"\n\n⚙️ Обработка обновлений\n"
+            f"🔄 Выполняется: {updates['in_flight']} (максимум {updates['max_in_flight']}, лимит {updates['limit']})\n"
+            f"⏳ Ожидают очереди: {updates['waiting']}\n"
+            f"💬 Активных чатов: {updates['chats']}\n"
+            f"✅ Обработано: {updates['processed']}"
+        )
+    text += f"\n🌊 Отброшено флуда: {flood_guard.dropped}"
+    await update.message.reply_text(text)
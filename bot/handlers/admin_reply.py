@@ -4,7 +4,7 @@ import re
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from bot.database.core import get_supabase
+from bot.database.user_cache import get_user_profile
 
 logger = logging.getLogger(__name__)
 
@@ -34,10 +34,8 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     admin_reply_text = update.message.text
 
     # --- ДОБАВЛЕНО: Проверка, не заблокирован ли пользователь ---
-    supabase = get_supabase()
-    user_check_response = supabase.table('users').select('is_banned, banned_features').eq('user_id', user_id).execute()
-    if user_check_response.data:
-        user_data = user_check_response.data[0]
+    user_data = await get_user_profile(user_id)
+    if user_data:
         if user_data.get('is_banned') or 'all' in user_data.get('banned_features', []):
             # Пользователь заблокирован, не отправляем
             await update.message.reply_text("⚠️ Пользователь заблокирован, сообщение не отправлено.")
@@ -2,10 +2,11 @@
 import re
 import os
 import logging
-from datetime import datetime, timedelta, timezone # Добавлен timezone
+from datetime import timezone # Добавлен timezone
 from telegram import Update, ReplyKeyboardRemove, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler
-from bot.database.core import get_supabase
+from bot.database.user_cache import update_user
+from bot.services.eligibility import check_eligibility, ANKETA_DRAFT_KEY
 
 # Состояния для анкеты
 NAME, AGE, GAME_NICKNAME, WHY_JOIN = range(4)
@@ -29,100 +30,18 @@ def validate_nickname(nickname: str) -> bool:
 async def start_application(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Начинает процесс заполнения анкеты."""
     user_id = update.effective_user.id
-    supabase = get_supabase()
     
-    # --- ДОБАВЛЕНО: Проверка полного бана ---
-    user_response = supabase.table('users').select('is_banned').eq('user_id', user_id).execute()
-    if user_response.data:
-        user_data = user_response.data[0]
-        if user_data.get('is_banned'):
-            await update.message.reply_text("❌ Вы заблокированы и не можете пользоваться ботом.")
-            # Возвращаем основное меню без кнопок анкеты и обращения
-            main_keyboard = [
-                ["🤖 О боте"],
-                ["🐍 Змейка", "🎡 Барабан", "⚙️ Настройки"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
+    # Бан, ограничения, незавершённые формы и задержки
+    verdict = await check_eligibility(user_id, 'anketa', context.user_data)
+    if not verdict.allowed:
+        await update.message.reply_text(verdict.text)
+        if verdict.keyboard:
+            reply_markup = ReplyKeyboardMarkup(verdict.keyboard, resize_keyboard=True)
             await update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
-            return ConversationHandler.END
-    # --- КОНЕЦ ДОБАВЛЕНИЯ ---
-    
-    # --- ДОБАВЛЕНО: Проверка частичного бана для анкеты ---
-    user_response = supabase.table('users').select('banned_features').eq('user_id', user_id).execute()
-    if user_response.data:
-        user_data = user_response.data[0]
-        banned_features = user_data.get('banned_features', [])
-        if 'anketa' in banned_features:
-            await update.message.reply_text("❌ Вы не можете подавать анкеты.")
-            # Возвращаем основное меню без кнопки анкеты
-            main_keyboard = [
-                ["🤖 О боте", "📨 Обращение"],
-                ["🐍 Змейка", "🎡 Барабан", "⚙️ Настройки"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(main_keyboard, resize_keyboard=True)
-            await update.message.reply_text("Выберите действие:", reply_markup=reply_markup)
-            return ConversationHandler.END
-    # --- КОНЕЦ ДОБАВЛЕНИЯ ---
-    
-    # Проверяем, не находится ли пользователь уже в процессе анкеты или обращения
-    anketa_check = supabase.table('temp_applications').select('user_id').eq('user_id', user_id).execute()
-    appeal_check = supabase.table('temp_appeals').select('user_id').eq('user_id', user_id).execute()
-    
-    if anketa_check.data or appeal_check.data:
-        await update.message.reply_text("❌ Вы уже заполняете анкету или обращение. Дождитесь завершения.")
         return ConversationHandler.END
     
-    # Проверяем задержку
-    response = supabase.table('users').select('last_anketa_time, last_appeal_time').eq('user_id', user_id).execute()
-    if response.data:
-        user_data = response.data[0]
-        last_anketa = user_data.get('last_anketa_time')
-        last_appeal = user_data.get('last_appeal_time')
-
-        # --- ИСПРАВЛЕНО: Используем timezone-aware now ---
-        now = datetime.now(timezone.utc)
-
-        if last_anketa:
-            # last_anketa приходит в формате ISO 8601
-            # ИСПРАВЛЕНО: явно указываем tzinfo
-            last_anketa_time = datetime.fromisoformat(last_anketa.replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
-            time_diff = now - last_anketa_time # Теперь оба aware
-            # Проверяем, прошло ли 3 часа
-            if time_diff < timedelta(hours=3):
-                # Если прошло меньше 3 часов, проверяем задержки
-                if time_diff < timedelta(minutes=3):
-                    # Первая отправка - 3 минуты
-                    await update.message.reply_text("⏱️ Повторная анкета возможна только через 3 минуты после отправки предыдущей.")
-                    return ConversationHandler.END
-                elif time_diff < timedelta(minutes=20):
-                    # Повторная отправка - 20 минут
-                    await update.message.reply_text("⏱️ Повторная анкета возможна только через 20 минут после отправки предыдущей.")
-                    return ConversationHandler.END
-
-        if last_appeal:
-            # last_appeal приходит в формате ISO 8601
-            # ИСПРАВЛЕНО: явно указываем tzinfo
-            last_appeal_time = datetime.fromisoformat(last_appeal.replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
-            time_diff = now - last_appeal_time # Теперь оба aware
-            # Проверяем, прошло ли 3 часа
-            if time_diff < timedelta(hours=3):
-                # Если прошло меньше 3 часов, проверяем задержки
-                if time_diff < timedelta(minutes=20):
-                    # Повторная отправка - 20 минут
-                    await update.message.reply_text("⏱️ Анкету можно отправить только через 20 минут после предыдущего обращения.")
-                    return ConversationHandler.END
-                elif time_diff < timedelta(minutes=3):
-                    # Первая отправка - 3 минуты
-                    await update.message.reply_text("⏱️ Анкету можно отправить только через 3 минуты после предыдущего обращения.")
-                    return ConversationHandler.END
-    
-    # Удаляем предыдущую незавершённую анкету
-    supabase.table('temp_applications').delete().eq('user_id', user_id).execute()
-    # Создаём новую запись
-    supabase.table('temp_applications').insert({
-        'user_id': user_id,
-        'step': 'name'
-    }).execute()
+    # Ответы копим в user_data и пишем в БД один раз — при отправке анкеты
+    context.user_data[ANKETA_DRAFT_KEY] = {}
     
     # Клавиатура с отменой
     keyboard = [
@@ -139,7 +58,6 @@ async def start_application(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Получает имя."""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     if text == "❌ Отменить":
@@ -153,11 +71,7 @@ async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         )
         return NAME
     
-    supabase = get_supabase()
-    supabase.table('temp_applications').update({
-        'name': text,
-        'step': 'age'
-    }).eq('user_id', user_id).execute()
+    context.user_data.setdefault(ANKETA_DRAFT_KEY, {})['name'] = text
     
     await update.message.reply_text(
         "🔢 Введите ваш возраст (только цифры от 12 до 100):"
@@ -166,7 +80,6 @@ async def receive_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def receive_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Получает возраст."""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     if text == "❌ Отменить":
@@ -188,11 +101,7 @@ async def receive_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         )
         return AGE
     
-    supabase = get_supabase()
-    supabase.table('temp_applications').update({
-        'age': text,
-        'step': 'game_nickname'
-    }).eq('user_id', user_id).execute()
+    context.user_data.setdefault(ANKETA_DRAFT_KEY, {})['age'] = text
     
     await update.message.reply_text(
         "🎮 Введите ваш игровой ник (только латинские буквы, цифры и _):"
@@ -201,7 +110,6 @@ async def receive_age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
 async def receive_game_nickname(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Получает игровой ник."""
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     if text == "❌ Отменить":
@@ -214,11 +122,7 @@ async def receive_game_nickname(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return GAME_NICKNAME
     
-    supabase = get_supabase()
-    supabase.table('temp_applications').update({
-        'game_nickname': text,
-        'step': 'why_join'
-    }).eq('user_id', user_id).execute()
+    context.user_data.setdefault(ANKETA_DRAFT_KEY, {})['game_nickname'] = text
     
     await update.message.reply_text(
         "💬 Почему вы хотите в наш сквад? Расскажите о себе:"
@@ -240,20 +144,12 @@ async def receive_why_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
         return WHY_JOIN
     
-    supabase = get_supabase()
-    # Сохраняем why_join в БД
-    supabase.table('temp_applications').update({
-        'why_join': text,
-        'step': 'completed'
-    }).eq('user_id', user_id).execute()
-    
-    # Получаем все данные
-    response = supabase.table('temp_applications').select('*').eq('user_id', user_id).execute()
-    if not response.data:
+    # Забираем накопленные ответы
+    data = context.user_data.pop(ANKETA_DRAFT_KEY, None)
+    if not data or not all(key in data for key in ('name', 'age', 'game_nickname')):
         await update.message.reply_text("❌ Ошибка: данные не найдены.")
         return ConversationHandler.END
-    
-    data = response.data[0]
+    data['why_join'] = text
     
     # Получаем username
     try:
@@ -285,9 +181,9 @@ async def receive_why_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             # Обновляем время последней анкеты
             # ИСПРАВЛЕНО: используем timezone-aware datetime
             from datetime import datetime
-            supabase.table('users').update({
+            await update_user(user_id, {
                 'last_anketa_time': datetime.now(timezone.utc).isoformat()
-            }).eq('user_id', user_id).execute()
+            })
             
         except Exception as e:
             logger.error(f"Ошибка при отправке в админ-чат: {e}")
@@ -295,9 +191,6 @@ async def receive_why_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     else:
         await update.message.reply_text("❌ Админ-чат не настроен.")
     
-    # Удаляем временную запись
-    supabase.table('temp_applications').delete().eq('user_id', user_id).execute()
-    
     # Возвращаем основное меню
     main_keyboard = [
         ["🤖 О боте", "📝 Анкета", "📨 Обращение"],
@@ -310,9 +203,7 @@ async def receive_why_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Отменяет заполнение анкеты."""
-    user_id = update.effective_user.id
-    supabase = get_supabase()
-    supabase.table('temp_applications').delete().eq('user_id', user_id).execute()
+    context.user_data.pop(ANKETA_DRAFT_KEY, None)
     
     await update.message.reply_text(
         "❌ Заполнение анкеты отменено.",
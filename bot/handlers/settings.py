@@ -2,23 +2,22 @@
 import logging
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
-from bot.database.core import get_supabase
+from bot.database.user_cache import get_user_profile, toggle_broadcast
 
 logger = logging.getLogger(__name__)
 
 async def settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показывает меню настроек."""
     user_id = update.effective_user.id
-    supabase = get_supabase()
 
-    # Получаем текущий статус пользователя из БД
-    response = supabase.table('users').select('can_receive_broadcast').eq('user_id', user_id).execute()
+    # Получаем текущий статус пользователя (из кэша профилей или БД)
+    user_data = await get_user_profile(user_id)
     
-    if not response.data:
+    if not user_data:
         await update.message.reply_text("❌ Ошибка: пользователь не найден.")
         return
 
-    can_receive = response.data[0]['can_receive_broadcast']
+    can_receive = user_data['can_receive_broadcast']
     status_text = "🔕 Рассылка отключена" if not can_receive else "🔔 Рассылка включена"
 
     keyboard = [
@@ -36,21 +35,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await query.answer()
 
     user_id = update.effective_user.id
-    supabase = get_supabase()
 
     if query.data == "toggle_broadcast":
-        # Получаем текущий статус
-        response = supabase.table('users').select('can_receive_broadcast').eq('user_id', user_id).execute()
-        if not response.data:
+        # Статус переключается на стороне БД одним запросом, кэш обновляется новым значением
+        new_status = await toggle_broadcast(user_id)
+        if new_status is None:
             await query.edit_message_text("❌ Ошибка: пользователь не найден.")
             return
 
-        current_status = response.data[0]['can_receive_broadcast']
-        new_status = not current_status
-
-        # Обновляем статус в БД
-        supabase.table('users').update({'can_receive_broadcast': new_status}).eq('user_id', user_id).execute()
-
         status_text = "🔕 Рассылка отключена" if not new_status else "🔔 Рассылка включена"
         await query.edit_message_text(f"✅ {status_text}")
 
@@ -1,9 +1,14 @@
 # bot/handlers/start.py
 import logging
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import ContextTypes
-# ИМПОРТИРУЕМ get_supabase из bot.database.core
-from bot.database.core import create_user_if_not_exists, get_supabase
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+# Регистрация пользователя и кэш профилей
+from bot.database.core import create_user_if_not_exists
+from bot.database.user_cache import get_user_profile, update_user
+from bot.handlers.admin import get_admin_ids
+from bot.services.antiflood import flood_guard, ALLOW, MUTE
+from bot.services.bans import ban_registry
+from bot.services.eligibility import FORMS
 
 logger = logging.getLogger(__name__)
 
@@ -20,13 +25,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         # Проверяем бан
         user_id = update.effective_user.id
-        # ИСПОЛЬЗУЕМ get_supabase, которая теперь импортирована
-        supabase = get_supabase()
-        # ПРАВИЛЬНО: используем response.data
-        response = supabase.table('users').select('is_banned, banned_features, can_receive_broadcast').eq('user_id', user_id).execute()
+        # Профиль берём из кэша, чтобы не читать одну и ту же строку несколько раз
+        user_data = await get_user_profile(user_id)
         
-        if response.data:
-            user_data = response.data[0]
+        if user_data:
+            # Пользователь снова с нами — возвращаем его в рассылки
+            if user_data.get('unreachable_at'):
+                await update_user(user_id, {'unreachable_at': None})
+
             is_banned = user_data.get('is_banned')
             banned_features = user_data.get('banned_features', [])
             can_receive_broadcast = user_data.get('can_receive_broadcast', True)
@@ -114,3 +120,70 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
         except:
             pass
+
+
+# Кнопки меню, ведущие к формам, которые можно ограничить отдельно
+FORM_BUTTONS = {"📝 Анкета": 'anketa', "📨 Обращение": 'appeal'}
+
+async def ban_gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отсекает заблокированных и ограниченных пользователей до остальных обработчиков.
+
+    Проверка идёт по ban_registry в памяти, без запросов к БД. Пока реестр не
+    загружен (загрузка не удалась и повторяется), статус пользователя берётся
+    из его профиля, чтобы заблокированные не проходили к обработчикам.
+    """
+    user = update.effective_user
+    if not user:
+        return
+    if user.id in get_admin_ids():
+        return
+
+    if not ban_registry.loaded:
+        try:
+            profile = await get_user_profile(user.id)
+        except Exception as e:
+            logger.error(f"❌ Не удалось проверить бан пользователя {user.id}: {e}")
+            profile = None
+        if profile:
+            ban_registry.apply_row(profile)
+
+    message = update.message
+    text = message.text if message else None
+
+    if ban_registry.is_banned(user.id):
+        # Отвечаем только на /start, остальное молча отбрасываем
+        if text and text.startswith('/start'):
+            await message.reply_text("❌ Вы заблокированы и не можете пользоваться ботом.", reply_markup=ReplyKeyboardRemove())
+        elif update.callback_query:
+            await update.callback_query.answer()
+        raise ApplicationHandlerStop
+
+    kind = FORM_BUTTONS.get(text)
+    if kind and ban_registry.is_restricted(user.id, kind):
+        form = FORMS[kind]
+        await message.reply_text(form['restricted_text'], reply_markup=ReplyKeyboardMarkup(form['restricted_keyboard'], resize_keyboard=True))
+        raise ApplicationHandlerStop
+
+async def flood_gate(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отбрасывает всплески запросов одного пользователя до остальных обработчиков."""
+    user = update.effective_user
+    if not user or user.id in get_admin_ids():
+        return
+
+    message = update.message
+    text = message.text if message else (update.callback_query.data if update.callback_query else None)
+    decision = flood_guard.check(user.id, text)
+    if decision == ALLOW:
+        return
+
+    # Предупреждаем один раз за паузу, дальше запросы отбрасываются молча
+    warning = f"⏳ Слишком много запросов. Подождите {flood_guard.mute_left(user.id):.0f} сек." if decision == MUTE else None
+    try:
+        if update.callback_query:
+            # Без ответа у пользователя так и крутятся «часики» на кнопке
+            await update.callback_query.answer(text=warning)
+        elif warning and update.effective_chat and update.effective_chat.type == 'private':
+            await context.bot.send_message(chat_id=user.id, text=warning)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось ответить пользователю {user.id} на флуд: {e}")
+    raise ApplicationHandlerStop
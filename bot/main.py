@@ -4,20 +4,20 @@ import asyncio
 import os
 import sys
 import logging
-import uuid
 import functools
-from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
 )
-from telegram import error as telegram_error, ReplyKeyboardMarkup
+from telegram import error as telegram_error, ReplyKeyboardMarkup, Update
 from dotenv import load_dotenv
-from bot.handlers.start import start
+from bot.handlers.start import start, ban_gate, flood_gate
 from bot.handlers.settings import settings_menu, button_handler, handle_settings_text
 from bot.handlers.admin import (
     list_all_users,
@@ -33,6 +33,12 @@ from bot.handlers.admin import (
     unban_user,
     restrict_user,
     unrestrict_user,
+    cache_stats,
+    track_username,
+    roster_callback,
+    export_users_command,
+    stats,
+    find_user,
 )
 from bot.handlers.broadcast import (
     broadcast_all,
@@ -42,8 +48,13 @@ from bot.handlers.broadcast import (
     broadcast_to_user, # НОВОЕ
     broadcast_to_group, # НОВОЕ
     list_subscribers, # НОВОЕ
+    broadcast_pause,
+    broadcast_resume,
+    broadcast_cancel,
+    track_media_group,
 )
-from bot.database.core import get_supabase
+from bot.database.core import warm_known_users
+from bot.database.persistence import SQLitePersistence
 from bot.handlers.anketa import (
     start_application,
     receive_name,
@@ -65,6 +76,10 @@ from bot.handlers.appeal import (
     MESSAGE,
 )
 from bot.handlers.admin_reply import handle_admin_reply
+from bot.services.broadcast_jobs import resume_broadcast_jobs, hand_over_broadcasts
+from bot.services.leader import leader_election
+from bot.services.update_processor import OrderedUpdateProcessor
+from bot.services.bans import load_bans, retry_load_bans
 
 logging.basicConfig(
     level=logging.INFO,
@@ -115,50 +130,37 @@ async def create_bot_application() -> "Application":
     token = os.getenv("BOT_TOKEN")
 
     logger.info("🔧 [BOT] Создаем Application...")
-    application = ApplicationBuilder().token(token).build()
-
-    logger.info("🔄 Инициализируем приложение...")
-    await application.initialize()
-
-    supabase = get_supabase()
-
-    # Управление инстансами
-    INSTANCE_ID = str(uuid.uuid4())
-    logger.info(f"🔑 Этот инстанс имеет ID: {INSTANCE_ID}")
-
-    # Деактивируем все предыдущие инстансы
-    logger.info("🔌 Деактивируем все предыдущие инстансы бота...")
-    try:
-        supabase.table("bot_instances").update({"is_active": False}).eq("is_active", True).execute()
-        logger.info("✅ Все предыдущие инстансы деактивированы.")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при деактивации старых инстансов: {e}")
-
-    # Автоочистка: удаляем инстансы старше 1 часа
-    logger.info("🧹 Очищаем старые инстансы (старше 1 часа)...")
-    try:
-        one_hour_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
-        supabase.table("bot_instances").delete().lt("started_at", one_hour_ago).execute()
-        logger.info("✅ Старые инстансы удалены.")
-    except Exception as e:
-        logger.error(f"❌ Ошибка при очистке старых инстансов: {e}")
+    # Состояния анкеты/обращения и user_data переживают перезапуск
+    # Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .persistence(SQLitePersistence())
+        .concurrent_updates(OrderedUpdateProcessor())
+        .build()
+    )
 
-    logger.info("✅ Регистрируем текущий инстанс как активный...")
+    # Управление инстансами: регистрируемся, ведущий выбирается при запуске.
+    # Если регистрация не удалась, запись создаст первый же вызов acquire_leadership
     try:
-        supabase.table("bot_instances").insert({
-            "instance_id": INSTANCE_ID,
-            "is_active": True,
-        }).execute()
-        logger.info("✅ Текущий инстанс успешно зарегистрирован.")
+        await leader_election.register()
     except Exception as e:
-        logger.error(f"❌ Ошибка при регистрации текущего инстанса: {e}")
+        logger.error(f"❌ Ошибка при регистрации текущего инстанса (запись создастся при выборах): {e}")
 
     # Регистрация обработчиков — ПОРЯДОК ВАЖЕН!
 
+    # Всплески запросов от одного пользователя отбрасываются раньше всего остального
+    application.add_handler(TypeHandler(Update, flood_gate), group=-3)
+    # Индекс username -> user_id обновляется по каждому обновлению до остальных обработчиков
+    application.add_handler(TypeHandler(Update, track_username), group=-2)
+    # Заблокированные пользователи отсекаются до команд и запросов к БД
+    application.add_handler(TypeHandler(Update, ban_gate), group=-1)
+
     # Команды (с логированием)
     application.add_handler(CommandHandler("start", log_handler(start)))
     application.add_handler(CommandHandler("settings", log_handler(settings_menu)))
-    application.add_handler(CallbackQueryHandler(log_handler(button_handler)))
+    application.add_handler(CallbackQueryHandler(log_handler(button_handler), pattern="^toggle_broadcast$"))
+    application.add_handler(CallbackQueryHandler(roster_callback, pattern="^roster:"))
     application.add_handler(CommandHandler("list_all", log_handler(list_all_users)))
     application.add_handler(CommandHandler("list_squad", log_handler(list_squad)))
     application.add_handler(CommandHandler("list_city", log_handler(list_city)))
@@ -175,12 +177,19 @@ async def create_bot_application() -> "Application":
     application.add_handler(CommandHandler("broadcast_to_user", log_handler(broadcast_to_user))) # НОВОЕ
     application.add_handler(CommandHandler("broadcast_to_group", log_handler(broadcast_to_group))) # НОВОЕ
     application.add_handler(CommandHandler("list_subscribers", log_handler(list_subscribers))) # НОВОЕ
+    application.add_handler(CommandHandler("broadcast_pause", log_handler(broadcast_pause)))
+    application.add_handler(CommandHandler("broadcast_resume", log_handler(broadcast_resume)))
+    application.add_handler(CommandHandler("broadcast_cancel", log_handler(broadcast_cancel)))
     
     # --- ДОБАВЛЕНО: Команды бана ---
     application.add_handler(CommandHandler("ban", log_handler(ban_user)))
     application.add_handler(CommandHandler("unban", log_handler(unban_user)))
     application.add_handler(CommandHandler("restrict", log_handler(restrict_user)))
     application.add_handler(CommandHandler("unrestrict", log_handler(unrestrict_user)))
+    application.add_handler(CommandHandler("cache_stats", log_handler(cache_stats)))
+    application.add_handler(CommandHandler("export", log_handler(export_users_command)))
+    application.add_handler(CommandHandler("stats", log_handler(stats)))
+    application.add_handler(CommandHandler("find", log_handler(find_user)))
     # --- КОНЕЦ ДОБАВЛЕНИЯ ---
 
     # FSM для анкеты
@@ -195,6 +204,8 @@ async def create_bot_application() -> "Application":
             },
             # --- ИСПРАВЛЕНО: добавлен отдельный handler для /cancel ---
             fallbacks=[CommandHandler("cancel", cancel)],
+            name="anketa",
+            persistent=True,
         )
     )
 
@@ -208,6 +219,8 @@ async def create_bot_application() -> "Application":
             },
             # --- ИСПРАВЛЕНО: добавлен отдельный handler для /cancel ---
             fallbacks=[CommandHandler("cancel", cancel_appeal)],
+            name="appeal",
+            persistent=True,
         )
     )
 
@@ -222,30 +235,89 @@ async def create_bot_application() -> "Application":
     # Обработчик текстовых сообщений для "Настройки"
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_settings_text))
 
+    # Запоминаем альбомы админов в отдельной группе, чтобы не мешать остальным обработчикам
+    application.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO | filters.Document.ALL | filters.AUDIO, track_media_group), group=1)
+
+    # Инициализируем после регистрации обработчиков: persistence загружает
+    # сохранённые состояния разговоров только для уже добавленных ConversationHandler
+    logger.info("🔄 Инициализируем приложение...")
+    await application.initialize()
+
     logger.info("🚀 Приложение бота инициализировано и готово к запуску.")
     return application
 
 
 # ... (остальной код файла, включая start_bot_application и stop_bot_application) ...
 
+# Режим получения обновлений: polling (по умолчанию) или webhook.
+# В режиме webhook обновления принимает aiohttp-сервер из run.py по адресу WEBHOOK_URL.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+
+def get_webhook_path() -> str:
+    """Путь маршрута вебхука — берётся из WEBHOOK_URL."""
+    return urlparse(os.getenv("WEBHOOK_URL", "")).path or "/webhook"
+
+
+async def _become_leader(application: "Application", app_context: dict):
+    """Начинает получать обновления и продолжает рассылки (инстанс стал ведущим)."""
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    # Пока инстанс был резервным, баны и пользователи могли измениться на ведущем,
+    # поэтому загружаем их заново. Баны нужны до первого обновления, а список
+    # зарегистрированных пользователей (чтобы /start не ходил в БД) — только кэш
+    if not await load_bans():
+        # Пока баны не загружены, ban_gate проверяет профиль каждого пользователя
+        application.create_task(retry_load_bans())
+    application.create_task(warm_known_users())
+    if BOT_MODE == "webhook":
+        logger.info(f"🔗 Устанавливаем вебхук на {WEBHOOK_URL}")
+        await application.bot.set_webhook(url=WEBHOOK_URL, secret_token=app_context["webhook_secret"], allowed_updates=Update.ALL_TYPES)
+        logger.info(f"📬 Обновления принимаются вебхуком на {get_webhook_path()}")
+    elif not application.updater.running:
+        # Polling не работает, пока у бота установлен вебхук
+        await application.bot.delete_webhook()
+        logger.info("🔄 Запускаем обработку обновлений (polling)...")
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+    # Продолжаем рассылки, прерванные перезапуском или сменой ведущего
+    application.create_task(resume_broadcast_jobs(application))
+
+
+async def _step_down(application: "Application"):
+    """Перестаёт получать обновления и отдаёт рассылки новому ведущему."""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    hand_over_broadcasts()
+
+
 async def start_bot_application(application: "Application", app_context: dict):
     """Запускает переданный экземпляр Application бота."""
     try:
-        # Устанавливаем вебхук (URL должен быть настроен в .env)
         WEBHOOK_URL = os.getenv("WEBHOOK_URL")
-        if WEBHOOK_URL:
-            logger.info(f"🔗 Устанавливаем вебхук на {WEBHOOK_URL}")
-            await application.bot.set_webhook(url=WEBHOOK_URL)
-        else:
-            logger.warning("⚠️ WEBHOOK_URL не установлен, вебхук не будет установлен.")
+        app_context["mode"] = BOT_MODE
+
+        if BOT_MODE == "webhook":
+            if not WEBHOOK_URL:
+                raise RuntimeError("BOT_MODE=webhook, но WEBHOOK_URL не установлен")
+            # Секрет, который Telegram присылает в заголовке каждого запроса вебхука.
+            # Вебхук ставит тот инстанс, что стал ведущим, поэтому секрет у всех
+            # инстансов должен быть один и тот же — случайный здесь не годится
+            app_context["webhook_secret"] = os.getenv("WEBHOOK_SECRET")
+            if not app_context["webhook_secret"]:
+                raise RuntimeError("BOT_MODE=webhook, но WEBHOOK_SECRET не установлен")
 
         logger.info("🚀 Запускаем приложение...")
         await application.start()
 
-        logger.info("🔄 Запускаем обработку обновлений...")
-        await application.updater.start_polling()
+        # Обновления получает и рассылки выполняет только ведущий инстанс;
+        # резервный ждёт, пока освободится аренда
+        leader_election.start(
+            on_elected=functools.partial(_become_leader, application, app_context),
+            on_demoted=functools.partial(_step_down, application),
+        )
+        app_context["leader"] = leader_election
 
-        logger.info("✅ Бот успешно запущен и работает.")
+        logger.info("✅ Бот успешно запущен и участвует в выборах ведущего.")
 
     except Exception as e:
         logger.exception("💥 Ошибка при запуске бота:")
@@ -256,6 +328,10 @@ async def stop_bot_application(application: "Application", app_context: dict):
     """Останавливает переданный экземпляр Application бота."""
     logger.info("🛑 Останавливаем бота...")
     try:
+        # Отдаём аренду сразу, чтобы резервный инстанс подхватил работу без ожидания
+        await leader_election.stop()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
         await application.stop()
         logger.info("⏹️ Приложение остановлено.")
         await application.shutdown()
@@ -0,0 +1,99 @@
+# bot/services/antiflood.py
+import os
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Не больше FLOOD_LIMIT обновлений от пользователя за FLOOD_WINDOW секунд
+FLOOD_WINDOW = float(os.getenv("FLOOD_WINDOW", "10"))
+FLOOD_LIMIT = int(os.getenv("FLOOD_LIMIT", "8"))
+# Повтор того же текста быстрее этого интервала (двойное нажатие) отбрасывается
+FLOOD_DUPLICATE_INTERVAL = float(os.getenv("FLOOD_DUPLICATE_INTERVAL", "1"))
+# Первая пауза за флуд, каждое следующее нарушение удваивает её (до FLOOD_MAX_MUTE)
+FLOOD_MUTE = float(os.getenv("FLOOD_MUTE", "30"))
+FLOOD_MAX_MUTE = float(os.getenv("FLOOD_MAX_MUTE", "3600"))
+# Через сколько секунд без нарушений счётчик нарушений сбрасывается
+FLOOD_STRIKE_RESET = float(os.getenv("FLOOD_STRIKE_RESET", "3600"))
+# Сколько пользователей помним (самые давно писавшие вытесняются)
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "10000"))
+
+ALLOW = 'allow'  # обработать
+DROP = 'drop'    # молча отбросить
+MUTE = 'mute'    # отбросить и один раз предупредить о паузе
+
+
+class _UserState:
+    __slots__ = ('hits', 'strikes', 'last_strike', 'muted_until', 'last_text', 'last_text_at')
+
+    def __init__(self, limit: int):
+        self.hits = deque(maxlen=limit)
+        self.strikes = 0
+        self.last_strike = 0.0
+        self.muted_until = 0.0
+        self.last_text = None
+        self.last_text_at = 0.0
+
+
+class FloodGuard:
+    """Ограничитель частоты запросов пользователя со скользящим окном.
+
+    Превысившие лимит получают паузу, которая растёт с каждым повторным
+    нарушением. Состояние хранится для ограниченного числа пользователей.
+    """
+
+    def __init__(self, limit: int = FLOOD_LIMIT, window: float = FLOOD_WINDOW, max_users: int = FLOOD_MAX_USERS):
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> _UserState
+        self.dropped = 0
+
+    def _state(self, user_id: int) -> _UserState:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.limit)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def check(self, user_id: int, text: str = None) -> str:
+        """Решает, что делать с очередным обновлением пользователя: ALLOW, DROP или MUTE."""
+        now = time.monotonic()
+        state = self._state(user_id)
+
+        if now < state.muted_until:
+            self.dropped += 1
+            return DROP
+
+        # Двойное нажатие на ту же кнопку
+        if text is not None and text == state.last_text and now - state.last_text_at < FLOOD_DUPLICATE_INTERVAL:
+            self.dropped += 1
+            return DROP
+        state.last_text, state.last_text_at = text, now
+
+        # В deque последние limit обновлений: если самое старое из них внутри окна — лимит превышен
+        if len(state.hits) == self.limit and now - state.hits[0] < self.window:
+            if now - state.last_strike > FLOOD_STRIKE_RESET:
+                state.strikes = 0
+            state.strikes += 1
+            state.last_strike = now
+            mute = min(FLOOD_MUTE * 2 ** (state.strikes - 1), FLOOD_MAX_MUTE)
+            state.muted_until = now + mute
+            state.hits.clear()
+            self.dropped += 1
+            logger.warning(f"🌊 Флуд от пользователя {user_id}: пауза {mute:.0f} сек. (нарушение №{state.strikes})")
+            return MUTE
+
+        state.hits.append(now)
+        return ALLOW
+
+    def mute_left(self, user_id: int) -> float:
+        state = self._users.get(user_id)
+        return max(0.0, state.muted_until - time.monotonic()) if state else 0.0
+
+
+flood_guard = FloodGuard()
@@ -0,0 +1,105 @@
+# bot/services/bans.py
+import os
+import asyncio
+import logging
+from bot.database.pagination import iter_pages
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд повторять неудавшуюся загрузку банов
+BANS_RETRY_INTERVAL = float(os.getenv("BANS_RETRY_INTERVAL", "30"))
+
+
+class BanRegistry:
+    """Заблокированные и ограниченные пользователи в памяти.
+
+    Загружается, когда инстанс становится ведущим, и обновляется командами
+    /ban, /unban, /restrict и /unrestrict, поэтому проверка бана перед
+    обработчиками не ходит в БД.
+    """
+
+    def __init__(self):
+        self._banned = set()
+        self._restricted = {}  # user_id -> множество ограничений ('anketa', 'appeal')
+        self.loaded = False
+
+    def apply_row(self, row: dict) -> None:
+        """Запоминает состояние пользователя по строке users."""
+        user_id = row['user_id']
+        features = set(row.get('banned_features') or [])
+        if row.get('is_banned') or 'all' in features:
+            self._banned.add(user_id)
+        else:
+            self._banned.discard(user_id)
+        features.discard('all')
+        if features:
+            self._restricted[user_id] = features
+        else:
+            self._restricted.pop(user_id, None)
+
+    def replace_with(self, other: "BanRegistry") -> None:
+        """Заменяет содержимое реестра (другие модули держат ссылку на этот объект)."""
+        self._banned = other._banned
+        self._restricted = other._restricted
+
+    def ban(self, user_id: int) -> None:
+        self._banned.add(user_id)
+
+    def unban(self, user_id: int) -> None:
+        # /unban снимает и все ограничения
+        self._banned.discard(user_id)
+        self._restricted.pop(user_id, None)
+
+    def restrict(self, user_id: int, feature: str) -> None:
+        self._restricted.setdefault(user_id, set()).add(feature)
+
+    def unrestrict(self, user_id: int, feature: str) -> None:
+        features = self._restricted.get(user_id)
+        if features:
+            features.discard(feature)
+            if not features:
+                del self._restricted[user_id]
+
+    def is_banned(self, user_id: int) -> bool:
+        return user_id in self._banned
+
+    def is_restricted(self, user_id: int, feature: str) -> bool:
+        return feature in self._restricted.get(user_id, ())
+
+    def __len__(self) -> int:
+        return len(self._banned) + len(self._restricted)
+
+
+ban_registry = BanRegistry()
+
+
+async def load_bans() -> bool:
+    """Загружает из БД всех заблокированных и ограниченных пользователей.
+
+    Вызывается, когда инстанс становится ведущим: пока он был резервным, баны
+    могли меняться на другом инстансе, поэтому реестр собирается заново.
+    Возвращает False, если загрузить не удалось.
+    """
+    fresh = BanRegistry()
+    count = 0
+    try:
+        async for page in iter_pages(
+            'users', 'user_id, is_banned, banned_features',
+            lambda q: q.or_('is_banned.eq.true,banned_features.neq.{}'),
+        ):
+            for row in page:
+                fresh.apply_row(row)
+            count += len(page)
+    except Exception as e:
+        logger.error(f"❌ Не удалось загрузить список банов: {e}")
+        return False
+    ban_registry.replace_with(fresh)
+    ban_registry.loaded = True
+    logger.info(f"🚫 Загружено заблокированных и ограниченных пользователей: {count}")
+    return True
+
+
+async def retry_load_bans(interval: float = BANS_RETRY_INTERVAL) -> None:
+    """Повторяет загрузку банов, пока она не удастся (до этого ban_gate сверяется с профилем)."""
+    while not await load_bans():
+        await asyncio.sleep(interval)
@@ -0,0 +1,409 @@
+# bot/services/broadcast_engine.py
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from datetime import timedelta
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram допускает ~30 сообщений в секунду в разные чаты и ~1 сообщение
+# в секунду в один чат. Берём с небольшим запасом.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+
+# Сколько «корзин» отдельных чатов держим в памяти, прежде чем чистить простаивающие
+MAX_CHAT_BUCKETS = 10000
+
+# Повторы при временных сетевых ошибках: экспоненциальная задержка с джиттером
+MAX_SEND_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+
+class TokenBucket:
+    """Ограничитель скорости по алгоритму «корзина токенов»."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        """Корзина полная и никто её не ждёт — её можно выбросить."""
+        self._refill()
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов (например, после RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> bool:
+        """Забирает один токен. Возвращает True, если пришлось ждать."""
+        waited = False
+        async with self._lock:
+            while True:
+                pause_left = self._paused_until - time.monotonic()
+                if pause_left > 0:
+                    waited = True
+                    await asyncio.sleep(pause_left)
+                    # За время паузы токены не копятся
+                    self._updated = time.monotonic()
+                    continue
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                waited = True
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class RateLimiter:
+    """Общий лимит бота плюс отдельный лимит на каждый чат."""
+
+    def __init__(self, rate: float = BROADCAST_RATE, per_chat_rate: float = BROADCAST_PER_CHAT_RATE):
+        self.global_bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self._chat_buckets = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {k: b for k, b in self._chat_buckets.items() if not b.idle}
+            bucket = TokenBucket(self.per_chat_rate)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int) -> bool:
+        """Ждёт разрешения на отправку в чат. Возвращает True, если отправку задержали."""
+        throttled = await self._chat_bucket(chat_id).acquire()
+        throttled = await self.global_bucket.acquire() or throttled
+        return throttled
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает все отправки на указанное время."""
+        logger.warning(f"⏸️ Telegram просит подождать {seconds:.0f} с, рассылка приостановлена.")
+        self.global_bucket.pause(seconds)
+
+
+# Один лимитер на процесс: лимит Telegram действует на бота целиком,
+# поэтому параллельные рассылки делят его между собой.
+limiter = RateLimiter()
+
+
+class BroadcastStats:
+    """Итоги рассылки."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.retried = 0
+        # Получатели, доставка которым невозможна в принципе (бот заблокирован, чат не найден)
+        self.unreachable = set()
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        # Время на паузе не входит в elapsed, иначе скорость и оценка окончания врут
+        self._paused_total = 0.0
+        self._paused_since = None
+
+    def mark_paused(self) -> None:
+        if self._paused_since is None and self.finished_at is None:
+            self._paused_since = time.monotonic()
+
+    def mark_resumed(self) -> None:
+        if self._paused_since is not None:
+            self._paused_total += time.monotonic() - self._paused_since
+            self._paused_since = None
+
+    def finish(self) -> None:
+        """Фиксирует окончание рассылки (вызывается один раз, в самом конце)."""
+        if self.finished_at is None:
+            self.mark_resumed()
+            self.finished_at = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        """Активное время рассылки, без пауз."""
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        paused = self._paused_total
+        if self._paused_since is not None:
+            paused += end - self._paused_since
+        return end - self.started_at - paused
+
+    @property
+    def rate(self) -> float:
+        """Достигнутая скорость, сообщений в секунду."""
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastControl:
+    """Управление запущенной рассылкой: пауза, продолжение, отмена."""
+
+    def __init__(self, paused: bool = False):
+        self._running = asyncio.Event()
+        if not paused:
+            self._running.set()
+        self.cancelled = False
+        self.handed_over = False
+
+    @property
+    def paused(self) -> bool:
+        return not self._running.is_set()
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        # Будим ожидающих, чтобы они увидели отмену
+        self._running.set()
+
+    def hand_over(self) -> None:
+        """Останавливает рассылку на этом инстансе, не завершая задание:
+        его продолжит новый ведущий инстанс."""
+        self.handed_over = True
+        self.cancel()
+
+    async def wait(self) -> None:
+        """Ждёт, пока рассылку не снимут с паузы."""
+        await self._running.wait()
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """RetryAfter.retry_after бывает int или timedelta в зависимости от версии PTB."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# Ошибки BadRequest, после которых писать в чат бессмысленно
+DEAD_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+def _is_dead_chat(error: BadRequest) -> bool:
+    message = str(error).lower()
+    return any(text in message for text in DEAD_CHAT_ERRORS)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class _Watermark:
+    """Наибольший chat_id, до которого (включительно) все отправки завершены.
+
+    Получатели ставятся в очередь по возрастанию chat_id, а завершаются в любом
+    порядке; отметка сдвигается только через непрерывный завершённый префикс.
+    Отправки считаются по порядковому номеру, поэтому повторы chat_id не мешают.
+    """
+
+    def __init__(self):
+        self._pending = deque()  # (номер, chat_id) в порядке постановки
+        self._done = set()
+        self._next = 0
+        self.value = None
+
+    def add(self, chat_id: int) -> int:
+        seq = self._next
+        self._next += 1
+        self._pending.append((seq, chat_id))
+        return seq
+
+    def complete(self, seq: int) -> None:
+        self._done.add(seq)
+        while self._pending and self._pending[0][0] in self._done:
+            head, chat_id = self._pending.popleft()
+            self._done.discard(head)
+            self.value = chat_id
+
+
+async def _single_page(chat_ids):
+    yield chat_ids
+
+
+class BroadcastEngine:
+    """Рассылает сообщения параллельно с ограничением скорости.
+
+    send — корутина send(chat_id), которая отправляет одно сообщение одному получателю.
+    Ошибки разбираются по типу: RetryAfter приостанавливает общий лимитер и ставит
+    отправку обратно в очередь, временные сетевые ошибки повторяются с задержкой,
+    и только постоянные (Forbidden, BadRequest вроде «chat not found») считаются недоставкой.
+    """
+
+    def __init__(self, send, concurrency: int = BROADCAST_CONCURRENCY, rate_limiter: RateLimiter = None,
+                 control: BroadcastControl = None):
+        self.send = send
+        self.concurrency = max(1, concurrency)
+        self.limiter = rate_limiter or limiter
+        self.control = control
+
+    async def _requeue(self, queue: asyncio.Queue, item: tuple, delay: float) -> None:
+        """Возвращает отправку в очередь после задержки."""
+        await asyncio.sleep(delay)
+        await queue.put(item)
+        # Исходный элемент считается обработанным только после повторной постановки,
+        # иначе queue.join() мог бы завершиться раньше времени
+        queue.task_done()
+
+    async def _worker(self, queue: asyncio.Queue, stats: BroadcastStats, retries: set, on_done) -> None:
+        while True:
+            chat_id, attempt, seq = await queue.get()
+            if self.control:
+                await self.control.wait()
+                if self.control.cancelled:
+                    # Отменённая отправка не завершена: отметка прогресса на ней остановится
+                    queue.task_done()
+                    continue
+            if await self.limiter.acquire(chat_id):
+                stats.throttled += 1
+
+            delay = None
+            try:
+                await self.send(chat_id)
+                stats.sent += 1
+            except RetryAfter as e:
+                seconds = _retry_after_seconds(e)
+                self.limiter.pause(seconds)
+                stats.throttled += 1
+                # Лимитер уже на паузе, поэтому ставим обратно сразу
+                delay = 0
+            except Forbidden as e:
+                logger.warning(f"Не удалось отправить пользователю {chat_id}: {e}")
+                stats.failed += 1
+                stats.unreachable.add(chat_id)
+            except BadRequest as e:
+                logger.warning(f"Не удалось отправить пользователю {chat_id}: {e}")
+                stats.failed += 1
+                if _is_dead_chat(e):
+                    stats.unreachable.add(chat_id)
+            except NetworkError as e:
+                # TimedOut — подкласс NetworkError
+                if attempt + 1 < MAX_SEND_ATTEMPTS:
+                    delay = _backoff_delay(attempt)
+                    logger.info(f"🔁 Временная ошибка для {chat_id} ({e}), повтор через {delay:.1f} с")
+                else:
+                    logger.warning(f"Не удалось отправить пользователю {chat_id} после {MAX_SEND_ATTEMPTS} попыток: {e}")
+                    stats.failed += 1
+            except Exception as e:
+                logger.warning(f"Не удалось отправить пользователю {chat_id}: {e}")
+                stats.failed += 1
+
+            if delay is None:
+                on_done(seq)
+                queue.task_done()
+            else:
+                stats.retried += 1
+                task = asyncio.create_task(self._requeue(queue, (chat_id, attempt + 1, seq), delay))
+                retries.add(task)
+                task.add_done_callback(retries.discard)
+
+    async def run_stream(self, pages, stats: BroadcastStats = None, checkpoint=None,
+                         checkpoint_every: int = 100) -> BroadcastStats:
+        """Рассылает получателям из асинхронного потока страниц pages (списков chat_id).
+
+        Страницы подаются в одну общую очередь ограниченного размера, так что
+        медленный получатель одной страницы не задерживает следующую. Если передан
+        checkpoint — корутина checkpoint(chat_id) -> bool, — она вызывается примерно
+        раз в checkpoint_every завершённых отправок и в конце с наибольшим chat_id,
+        до которого все отправки завершены (страницы должны идти по возрастанию
+        chat_id). Если checkpoint вернул False, рассылка передаётся другому
+        инстансу (control.hand_over()).
+
+        Если передан stats, счётчики накапливаются в нём, и завершать его
+        (stats.finish()) должен вызывающий код.
+        """
+        own_stats = stats is None
+        stats = stats or BroadcastStats()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        watermark = _Watermark()
+        completed_since_save = 0
+        save_due = asyncio.Event()
+
+        def on_done(seq: int) -> None:
+            nonlocal completed_since_save
+            watermark.complete(seq)
+            completed_since_save += 1
+            if checkpoint and completed_since_save >= checkpoint_every:
+                completed_since_save = 0
+                save_due.set()
+
+        saved = None
+
+        async def save() -> None:
+            nonlocal saved
+            value = watermark.value
+            if value is None or value == saved:
+                return
+            try:
+                ok = await checkpoint(value)
+            except Exception as e:
+                # Не страшно: следующая отметка сохранится позже
+                logger.error(f"❌ Не удалось сохранить прогресс рассылки: {e}")
+                return
+            saved = value
+            if not ok and self.control:
+                self.control.hand_over()
+
+        async def save_periodically() -> None:
+            while True:
+                await save_due.wait()
+                save_due.clear()
+                await save()
+
+        retries = set()
+        workers = [
+            asyncio.create_task(self._worker(queue, stats, retries, on_done))
+            for _ in range(self.concurrency)
+        ]
+        saver = asyncio.create_task(save_periodically()) if checkpoint else None
+        try:
+            async for page in pages:
+                if self.control and self.control.cancelled:
+                    break
+                for chat_id in page:
+                    if self.control and self.control.cancelled:
+                        break
+                    await queue.put((chat_id, 0, watermark.add(chat_id)))
+            await queue.join()
+        finally:
+            background = workers + list(retries) + ([saver] if saver else [])
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            if hasattr(pages, 'aclose'):
+                await pages.aclose()
+
+        if checkpoint and not (self.control and self.control.handed_over):
+            await save()
+        if own_stats:
+            stats.finish()
+        logger.info(
+            f"📊 Отправка завершена: отправлено {stats.sent}, не доставлено {stats.failed}, "
+            f"задержано лимитом {stats.throttled}, повторов {stats.retried}, {stats.rate:.1f} сообщ./с"
+        )
+        return stats
+
+    async def run(self, chat_ids, stats: BroadcastStats = None) -> BroadcastStats:
+        """Отправляет сообщение всем chat_ids и возвращает статистику."""
+        return await self.run_stream(_single_page(chat_ids), stats)
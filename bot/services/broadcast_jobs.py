@@ -0,0 +1,328 @@
+# bot/services/broadcast_jobs.py
+import os
+import asyncio
+import logging
+from telegram.ext import CallbackContext
+from bot.database.pagination import iter_pages, count_rows
+from bot.database.broadcast_jobs import (
+    create_job,
+    claim_job,
+    save_checkpoint,
+    set_job_status,
+    get_unfinished_jobs,
+    get_job,
+    mark_unreachable,
+)
+from bot.services.broadcast_engine import BroadcastEngine, BroadcastStats, BroadcastControl
+from bot.services.fanout import copy_content, resolve_source
+from bot.services import segments
+from bot.services.leader import leader_election
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в получателях) сохранять прогресс рассылки в БД. Получатели читаются
+# из БД страницами такого же размера, так что память не зависит от размера аудитории.
+# Сохраняется наибольший user_id, до которого все отправки завершены, поэтому при
+# перезапуске повторно уйдут только отправки, завершённые после последней отметки.
+CHECKPOINT_BATCH = int(os.getenv("BROADCAST_CHECKPOINT_BATCH", "100"))
+
+# Как часто (в секундах) обновлять статус-сообщение рассылки
+PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Сегменты получателей: фильтры поверх запроса к таблице users
+SEGMENTS = {
+    'all': lambda query: query,
+    'squad': lambda query: query.eq('is_in_squad', True),
+    'city': lambda query: query.eq('is_in_city', True),
+    'starly': lambda query: query.or_('is_in_squad.eq.true,is_in_city.eq.true'),
+}
+
+def _recipient_filter(segment: str):
+    """Фильтр получателей сегмента: те, кто получает рассылки (segments.receiving)."""
+    def apply(query):
+        return SEGMENTS[segment](segments.receiving(query))
+    return apply
+
+async def prune_unreachable(stats: BroadcastStats) -> None:
+    """Одной пачкой помечает получателей, доставка которым невозможна."""
+    try:
+        await mark_unreachable(stats.unreachable)
+    except Exception as e:
+        logger.error(f"❌ Не удалось пометить недоступных получателей: {e}")
+
+async def start_broadcast_job(segment: str, title: str, admin_chat_id: int, original_msg=None, text: str = None) -> dict:
+    """Сохраняет новое задание рассылки в БД."""
+    from_chat_id, message_ids = resolve_source(original_msg) if original_msg else (None, None)
+    return await create_job(segment, title, admin_chat_id, from_chat_id=from_chat_id, message_ids=message_ids, text=text)
+
+def _job_source(job: dict) -> tuple:
+    """Возвращает (from_chat_id, message_ids) задания.
+
+    Задания, созданные до перехода на copy_message, хранят полный Message в поле message.
+    """
+    if job.get('message_ids'):
+        return job['from_chat_id'], job['message_ids']
+    message = job.get('message')
+    if message:
+        return message['chat']['id'], [message['message_id']]
+    return None, None
+
+class BroadcastRun:
+    """Состояние выполняющегося задания рассылки."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self.control = BroadcastControl(paused=job.get('status') == 'paused')
+        self.stats = BroadcastStats()
+        if self.control.paused:
+            self.stats.mark_paused()
+        self.sent_before = job.get('sent') or 0
+        self.failed_before = job.get('failed') or 0
+        self.total = None
+        # Выставляется, когда рассылка на этом инстансе полностью остановилась
+        self.finished = asyncio.Event()
+        # Токен ведущего инстанса, от имени которого выполняется рассылка
+        self.fencing_token = leader_election.fencing_token
+
+    @property
+    def done(self) -> int:
+        return self.sent_before + self.failed_before + self.stats.sent + self.stats.failed
+
+# Выполняющиеся сейчас рассылки по id задания
+_runs = {}
+
+def get_running_job_ids() -> list:
+    """Возвращает id рассылок, которые выполняются в этом процессе."""
+    return sorted(_runs)
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин {seconds} с"
+    return f"{seconds} с"
+
+def _progress_text(run: BroadcastRun) -> str:
+    """Текст статус-сообщения о ходе рассылки."""
+    job = run.job
+    stats = run.stats
+    total = run.total or 0
+    percent = run.done * 100 // total if total else 0
+    remaining = max(total - run.done, 0)
+    if run.control.paused:
+        state = "⏸️ На паузе"
+        eta = "—"
+    else:
+        state = "▶️ Идёт"
+        eta = _format_duration(remaining / stats.rate) if stats.rate > 0 else "—"
+    return (
+        f"📤 {job['title']} #{job['id']}\n"
+        f"{state}: {run.done} из {total} ({percent}%)\n"
+        f"✅ Отправлено: {run.sent_before + stats.sent}\n"
+        f"❌ Не доставлено: {run.failed_before + stats.failed}\n"
+        f"⚡ Скорость: {stats.rate:.1f} сообщ./с\n"
+        f"⏱️ Осталось: {eta}\n\n"
+        f"/broadcast_pause {job['id']} · /broadcast_resume {job['id']} · /broadcast_cancel {job['id']}"
+    )
+
+def _final_text(run: BroadcastRun) -> str:
+    """Итоговый отчёт о рассылке."""
+    job = run.job
+    stats = run.stats
+    if run.total == 0:
+        return f"📭 {job['title']} #{job['id']}: список получателей пуст."
+    header = f"🛑 {job['title']} #{job['id']} отменена." if run.control.cancelled else f"✅ {job['title']} #{job['id']} завершена!"
+    return (
+        f"{header}\n"
+        f"📤 Отправлено: {run.sent_before + stats.sent}\n"
+        f"❌ Не доставлено: {run.failed_before + stats.failed}\n"
+        f"⏳ Задержано лимитом: {stats.throttled}\n"
+        f"🔁 Повторов: {stats.retried}\n"
+        f"⚡ Скорость: {stats.rate:.1f} сообщ./с\n"
+        f"⏱️ Время: {_format_duration(stats.elapsed)}"
+    )
+
+async def _edit_status(bot, chat_id: int, message_id: int, text: str) -> None:
+    try:
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+    except Exception as e:
+        # «message is not modified» и подобное не должны мешать рассылке
+        logger.debug(f"Не удалось обновить статус рассылки: {e}")
+
+async def _report_progress(bot, chat_id: int, message_id: int, run: BroadcastRun) -> None:
+    """Периодически обновляет статус-сообщение, не чаще раза в PROGRESS_INTERVAL секунд."""
+    last_text = None
+    while True:
+        text = _progress_text(run)
+        if text != last_text:
+            await _edit_status(bot, chat_id, message_id, text)
+            last_text = text
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+async def run_broadcast_job(bot, job: dict, status_chat_id: int = None, status_message_id: int = None) -> BroadcastStats:
+    """Выполняет задание рассылки, периодически сохраняя прогресс.
+
+    Если задание уже выполнялось (есть cursor), продолжает с первого
+    получателя после последней сохранённой отметки. Если передано статус-сообщение,
+    оно периодически редактируется с прогрессом, а в конце — с итогами.
+    """
+    from_chat_id, message_ids = _job_source(job)
+    text = job.get('text')
+
+    async def send(chat_id):
+        await copy_content(bot, chat_id, from_chat_id, message_ids, text)
+
+    run = BroadcastRun(job)
+    if run.fencing_token is None or not await claim_job(job['id'], run.fencing_token):
+        logger.warning(f"🪑 Рассылка #{job['id']} не запущена: этот инстанс не ведущий")
+        return run.stats
+    _runs[job['id']] = run
+    engine = BroadcastEngine(send, control=run.control)
+    progress_task = None
+    try:
+        recipient_filter = _recipient_filter(job['segment'])
+        cursor = job.get('cursor')
+
+        def remaining_filter(query):
+            if cursor is not None:
+                query = query.gt('user_id', cursor)
+            return recipient_filter(query)
+
+        # Общее число нужно только для прогресса, поэтому считаем его на стороне БД
+        remaining = await count_rows('users', remaining_filter)
+        run.total = run.done + remaining
+        if status_message_id:
+            progress_task = asyncio.create_task(_report_progress(bot, status_chat_id, status_message_id, run))
+
+        async def pages():
+            # Следующая страница получателей загружается, пока рассылается текущая
+            async for page in iter_pages('users', 'user_id', recipient_filter, after=cursor, page_size=CHECKPOINT_BATCH):
+                await run.control.wait()
+                yield [row['user_id'] for row in page]
+
+        async def checkpoint(last_user_id) -> bool:
+            return await save_checkpoint(job['id'], last_user_id, run.sent_before + run.stats.sent,
+                                         run.failed_before + run.stats.failed, run.fencing_token)
+
+        # Если save_checkpoint вернёт False, задание забрал новый ведущий, и движок
+        # передаст рассылку ему (control.hand_over())
+        await engine.run_stream(pages(), run.stats, checkpoint, checkpoint_every=CHECKPOINT_BATCH)
+
+        if not run.control.handed_over:
+            await set_job_status(job['id'], 'cancelled' if run.control.cancelled else 'done', run.fencing_token)
+        await prune_unreachable(run.stats)
+    finally:
+        _runs.pop(job['id'], None)
+        run.finished.set()
+        if progress_task:
+            progress_task.cancel()
+
+    run.stats.finish()
+    if run.control.handed_over:
+        logger.info(f"🔀 Рассылка #{job['id']} передана новому ведущему инстансу")
+        if status_message_id:
+            await _edit_status(bot, status_chat_id, status_message_id,
+                               f"🔀 {job['title']} #{job['id']}: продолжит другой инстанс бота.")
+        return run.stats
+    logger.info(f"✅ Задание рассылки #{job['id']} завершено: отправлено {run.stats.sent}, не доставлено {run.stats.failed}")
+    if status_message_id:
+        await _edit_status(bot, status_chat_id, status_message_id, _final_text(run))
+    return run.stats
+
+async def _broadcast_job_callback(context: CallbackContext) -> None:
+    """Колбэк JobQueue: выполняет рассылку в фоне."""
+    data = context.job.data
+    job = data['job']
+    try:
+        await run_broadcast_job(context.bot, job, data.get('chat_id'), data.get('message_id'))
+    except Exception as e:
+        logger.exception(f"💥 Ошибка при выполнении рассылки #{job['id']}: {e}")
+        if data.get('message_id'):
+            await _edit_status(context.bot, data['chat_id'], data['message_id'],
+                               f"❌ {job['title']} #{job['id']} прервана ошибкой: {e}")
+
+def schedule_broadcast_job(job_queue, job: dict, chat_id: int = None, message_id: int = None) -> None:
+    """Запускает рассылку в фоне через JobQueue."""
+    job_queue.run_once(
+        _broadcast_job_callback,
+        when=0,
+        data={'job': job, 'chat_id': chat_id, 'message_id': message_id},
+        name=f"broadcast-{job['id']}",
+    )
+
+async def pause_broadcast(job_id: int) -> bool:
+    """Ставит рассылку на паузу. Возвращает False, если такой рассылки нет."""
+    run = _runs.get(job_id)
+    if not run or run.control.cancelled:
+        return False
+    run.control.pause()
+    run.stats.mark_paused()
+    await set_job_status(job_id, 'paused', run.fencing_token)
+    return True
+
+async def resume_broadcast(job_id: int) -> bool:
+    """Снимает рассылку с паузы."""
+    run = _runs.get(job_id)
+    if not run or run.control.cancelled:
+        return False
+    run.control.resume()
+    run.stats.mark_resumed()
+    await set_job_status(job_id, 'running', run.fencing_token)
+    return True
+
+async def cancel_broadcast(job_id: int) -> bool:
+    """Отменяет рассылку. Уже отправленные сообщения остаются у получателей."""
+    run = _runs.get(job_id)
+    if not run:
+        return False
+    run.control.cancel()
+    return True
+
+def hand_over_broadcasts() -> None:
+    """Останавливает все рассылки этого инстанса, оставляя задания незавершёнными
+    (инстанс перестал быть ведущим, рассылки продолжит новый ведущий)."""
+    for run in list(_runs.values()):
+        run.control.hand_over()
+
+async def _resume_job(application, job: dict) -> None:
+    run = _runs.get(job['id'])
+    if run is not None:
+        if not run.control.handed_over:
+            # Рассылка уже идёт на этом инстансе
+            return
+        # Инстанс успел потерять и снова получить роль ведущего, а прежний запуск
+        # ещё дорабатывает (ждёт повторов). Дожидаемся его и берём задание заново
+        # со свежим курсором, иначе оно осталось бы running без исполнителя.
+        await run.finished.wait()
+        job = await get_job(job['id'])
+        if not job or job.get('status') not in ('running', 'paused') or job['id'] in _runs:
+            return
+
+    logger.info(f"▶️ Продолжаем рассылку #{job['id']} с user_id > {job.get('cursor')}")
+    chat_id = job.get('admin_chat_id')
+    message_id = None
+    if chat_id:
+        try:
+            message = await application.bot.send_message(
+                chat_id=chat_id,
+                text=f"▶️ {job['title']} #{job['id']} продолжается после перезапуска...",
+            )
+            message_id = message.message_id
+        except Exception as e:
+            logger.warning(f"Не удалось отправить статус рассылки #{job['id']}: {e}")
+    schedule_broadcast_job(application.job_queue, job, chat_id, message_id)
+
+async def resume_broadcast_jobs(application) -> None:
+    """Продолжает рассылки, прерванные перезапуском или сменой ведущего, в фоне через JobQueue."""
+    try:
+        jobs = await get_unfinished_jobs()
+    except Exception as e:
+        logger.error(f"❌ Не удалось получить незавершённые рассылки: {e}")
+        return
+
+    results = await asyncio.gather(*(_resume_job(application, job) for job in jobs), return_exceptions=True)
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Не удалось продолжить рассылку #{job['id']}: {result}")
@@ -0,0 +1,122 @@
+# bot/services/eligibility.py
+import logging
+from datetime import datetime, timedelta, timezone
+from bot.database.user_cache import get_user_profile
+
+logger = logging.getLogger(__name__)
+
+# Ключи context.user_data, где хранятся ответы незавершённых анкеты и обращения
+ANKETA_DRAFT_KEY = 'anketa_draft'
+APPEAL_DRAFT_KEY = 'appeal_draft'
+
+# Клавиатура после отказа: без кнопок, которые пользователю недоступны
+KEYBOARD_BANNED = [
+    ["🤖 О боте"],
+    ["🐍 Змейка", "🎡 Барабан", "⚙️ Настройки"]
+]
+
+# Для каждого вида формы: текст и клавиатура при ограничении, а также задержки.
+# own — задержка после предыдущей формы того же вида, other — после формы другого вида.
+# Задержки проверяются по порядку, срабатывает первая подходящая.
+FORMS = {
+    'anketa': {
+        'restricted_text': "❌ Вы не можете подавать анкеты.",
+        'restricted_keyboard': [
+            ["🤖 О боте", "📨 Обращение"],
+            ["🐍 Змейка", "🎡 Барабан", "⚙️ Настройки"]
+        ],
+        'own_time': 'last_anketa_time',
+        'other_time': 'last_appeal_time',
+        'check_own_first': True,
+        'own_cooldowns': [
+            (timedelta(minutes=3), "⏱️ Повторная анкета возможна только через 3 минуты после отправки предыдущей."),
+            (timedelta(minutes=20), "⏱️ Повторная анкета возможна только через 20 минут после отправки предыдущей."),
+        ],
+        'other_cooldowns': [
+            (timedelta(minutes=20), "⏱️ Анкету можно отправить только через 20 минут после предыдущего обращения."),
+        ],
+    },
+    'appeal': {
+        'restricted_text': "❌ Вы не можете подавать обращения.",
+        'restricted_keyboard': [
+            ["🤖 О боте", "📝 Анкета"],
+            ["🐍 Змейка", "🎡 Барабан", "⚙️ Настройки"]
+        ],
+        'own_time': 'last_appeal_time',
+        'other_time': 'last_anketa_time',
+        'check_own_first': False,
+        'own_cooldowns': [
+            (timedelta(minutes=3), "⏱️ Повторное обращение возможно только через 3 минуты после отправки предыдущего."),
+            (timedelta(minutes=20), "⏱️ Повторное обращение возможно только через 20 минут после отправки предыдущего."),
+        ],
+        'other_cooldowns': [
+            (timedelta(minutes=20), "⏱️ Обращение можно отправить только через 20 минут после предыдущей анкеты."),
+        ],
+    },
+}
+
+
+class Eligibility:
+    """Решение о том, можно ли начать анкету или обращение."""
+
+    def __init__(self, allowed: bool, reason: str = None, text: str = None, keyboard: list = None):
+        self.allowed = allowed
+        self.reason = reason      # banned | restricted | in_progress | cooldown
+        self.text = text          # что ответить пользователю при отказе
+        self.keyboard = keyboard  # меню, которое показать после отказа (или None)
+
+
+ALLOWED = Eligibility(True)
+
+
+def _cooldown_text(last_time: str, cooldowns: list, now: datetime):
+    """Возвращает текст отказа, если с last_time прошло меньше одной из задержек."""
+    if not last_time:
+        return None
+    # last_time приходит в формате ISO 8601
+    sent_at = datetime.fromisoformat(last_time.replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
+    time_diff = now - sent_at
+    for limit, text in cooldowns:
+        if time_diff < limit:
+            return text
+    return None
+
+
+def evaluate(state: dict, kind: str) -> Eligibility:
+    """Выносит решение по состоянию пользователя (без обращений к БД)."""
+    form = FORMS[kind]
+
+    if state.get('is_banned'):
+        return Eligibility(False, 'banned', "❌ Вы заблокированы и не можете пользоваться ботом.", KEYBOARD_BANNED)
+
+    if kind in (state.get('banned_features') or []):
+        return Eligibility(False, 'restricted', form['restricted_text'], form['restricted_keyboard'])
+
+    if state.get('has_anketa_draft') or state.get('has_appeal_draft'):
+        return Eligibility(False, 'in_progress', "❌ Вы уже заполняете анкету или обращение. Дождитесь завершения.")
+
+    now = datetime.now(timezone.utc)
+    checks = [
+        (state.get(form['own_time']), form['own_cooldowns']),
+        (state.get(form['other_time']), form['other_cooldowns']),
+    ]
+    if not form['check_own_first']:
+        checks.reverse()
+    for last_time, cooldowns in checks:
+        text = _cooldown_text(last_time, cooldowns, now)
+        if text:
+            return Eligibility(False, 'cooldown', text)
+
+    return ALLOWED
+
+
+async def check_eligibility(user_id: int, kind: str, user_data: dict) -> Eligibility:
+    """Проверяет, может ли пользователь начать форму kind ('anketa' или 'appeal').
+
+    Бан, ограничения и время последних форм берутся из профиля (кэш или один
+    запрос к БД), незавершённые формы — из user_data разговора, без обращений к БД.
+    """
+    state = dict(await get_user_profile(user_id) or {})
+    state['has_anketa_draft'] = ANKETA_DRAFT_KEY in user_data
+    state['has_appeal_draft'] = APPEAL_DRAFT_KEY in user_data
+    return evaluate(state, kind)
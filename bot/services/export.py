@@ -0,0 +1,82 @@
+# bot/services/export.py
+import io
+import os
+import csv
+import gzip
+import json
+import shutil
+import asyncio
+import logging
+import tempfile
+from bot.database.pagination import iter_pages
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    'user_id', 'username', 'first_name', 'last_name', 'is_in_squad', 'is_in_city',
+    'is_banned', 'banned_features', 'can_receive_broadcast', 'created_at',
+]
+# Сколько байт держим в памяти, прежде чем буфер переедет во временный файл на диске
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(4 * 1024 * 1024)))
+# Начиная с какого размера файл сжимается gzip
+EXPORT_GZIP_THRESHOLD = int(os.getenv("EXPORT_GZIP_THRESHOLD", str(1024 * 1024)))
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+def _encode_page(rows: list, fmt: str) -> bytes:
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buffer)
+        for row in rows:
+            values = [row.get(column) for column in EXPORT_COLUMNS]
+            # banned_features — массив, в таблице удобнее одной ячейкой
+            values[EXPORT_COLUMNS.index('banned_features')] = ';'.join(row.get('banned_features') or [])
+            writer.writerow(['' if value is None else value for value in values])
+    else:
+        for row in rows:
+            buffer.write(json.dumps({column: row.get(column) for column in EXPORT_COLUMNS}, ensure_ascii=False))
+            buffer.write('\n')
+    return buffer.getvalue().encode('utf-8')
+
+
+def _gzip(source, filename: str):
+    """Сжимает содержимое source в новый буфер (вызывается в отдельном потоке)."""
+    target = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    source.seek(0)
+    with gzip.GzipFile(filename=filename, mode='wb', fileobj=target) as archive:
+        shutil.copyfileobj(source, archive)
+    source.close()
+    target.seek(0)
+    return target
+
+
+async def export_users(apply_filters=None, fmt: str = 'csv', name: str = 'users') -> tuple:
+    """Выгружает пользователей в файл CSV или JSONL, читая таблицу постранично.
+
+    В памяти одновременно держится не больше двух страниц и EXPORT_SPOOL_SIZE
+    байт буфера, остальное уходит во временный файл. Большие выгрузки сжимаются.
+    Возвращает (file, filename, количество строк); file нужно закрыть.
+    """
+    filename = f"{name}.{fmt}"
+    output = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    count = 0
+    try:
+        if fmt == 'csv':
+            # Заголовок с BOM, чтобы Excel правильно открыл кириллицу
+            output.write(('\ufeff' + ','.join(EXPORT_COLUMNS) + '\r\n').encode('utf-8'))
+        async for page in iter_pages('users', ', '.join(EXPORT_COLUMNS), apply_filters):
+            output.write(_encode_page(page, fmt))
+            count += len(page)
+
+        if output.tell() > EXPORT_GZIP_THRESHOLD:
+            output = await asyncio.to_thread(_gzip, output, filename)
+            filename += '.gz'
+        else:
+            output.seek(0)
+    except Exception:
+        output.close()
+        raise
+
+    logger.info(f"📤 Выгрузка {filename}: {count} пользователей")
+    return output, filename, count
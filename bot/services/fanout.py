@@ -0,0 +1,47 @@
+# bot/services/fanout.py
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Сколько альбомов помним. Telegram не даёт получить остальные сообщения альбома
+# по одному из них, поэтому собираем их сами по мере поступления.
+MAX_MEDIA_GROUPS = 500
+
+# (chat_id, media_group_id) -> множество message_id
+_media_groups = OrderedDict()
+
+def remember_media_group(message) -> None:
+    """Запоминает сообщение, если оно часть альбома (media group)."""
+    if not message or not message.media_group_id:
+        return
+    key = (message.chat_id, message.media_group_id)
+    _media_groups.setdefault(key, set()).add(message.message_id)
+    _media_groups.move_to_end(key)
+    while len(_media_groups) > MAX_MEDIA_GROUPS:
+        _media_groups.popitem(last=False)
+
+def resolve_source(message) -> tuple:
+    """Возвращает (from_chat_id, [message_id, ...]) для рассылки сообщения.
+
+    Для альбома — все известные сообщения альбома по возрастанию id.
+    """
+    message_ids = [message.message_id]
+    if message.media_group_id:
+        group = _media_groups.get((message.chat_id, message.media_group_id))
+        if group:
+            message_ids = sorted(group | {message.message_id})
+    return message.chat_id, message_ids
+
+async def copy_content(bot, chat_id: int, from_chat_id: int = None, message_ids: list = None, text: str = None) -> None:
+    """Отправляет один и тот же контент получателю одним вызовом API.
+
+    copy_message/copy_messages сохраняют любой тип контента (фото, опросы, альбомы
+    и т. д.) с форматированием, без подписи «Переслано от».
+    """
+    if not message_ids:
+        await bot.send_message(chat_id=chat_id, text=text)
+    elif len(message_ids) == 1:
+        await bot.copy_message(chat_id=chat_id, from_chat_id=from_chat_id, message_id=message_ids[0])
+    else:
+        await bot.copy_messages(chat_id=chat_id, from_chat_id=from_chat_id, message_ids=message_ids)
@@ -0,0 +1,158 @@
+# bot/services/leader.py
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from bot.database.core import get_supabase, execute
+
+logger = logging.getLogger(__name__)
+
+# Срок аренды ведущего и как часто её продлевать (секунды)
+LEADER_LEASE_SECONDS = int(os.getenv("LEADER_LEASE_SECONDS", "15"))
+LEADER_HEARTBEAT_INTERVAL = float(os.getenv("LEADER_HEARTBEAT_INTERVAL", "5"))
+# Сколько ждать ответа на продление аренды; зависший запрос считается ошибкой
+LEADER_RPC_TIMEOUT = float(os.getenv("LEADER_RPC_TIMEOUT", str(LEADER_HEARTBEAT_INTERVAL / 2)))
+# Сколько может длиться запуск работы ведущего (загрузка банов, вебхук/polling)
+LEADER_ELECTED_TIMEOUT = float(os.getenv("LEADER_ELECTED_TIMEOUT", "60"))
+# Записи экземпляров без heartbeat дольше этого срока удаляются
+STALE_INSTANCE_AGE = timedelta(hours=1)
+
+
+class LeaderElection:
+    """Выбор ведущего экземпляра бота через аренду в таблице bot_instances.
+
+    Только ведущий получает обновления и выполняет рассылки. Резервный
+    экземпляр каждые LEADER_HEARTBEAT_INTERVAL секунд пытается захватить
+    аренду и становится ведущим в течение нескольких секунд после того,
+    как аренда прежнего ведущего истекла.
+
+    Запуск работы ведущего (on_elected) идёт отдельной задачей, чтобы аренда
+    продлевалась и во время него; при потере аренды эта задача отменяется.
+    """
+
+    def __init__(self, instance_id: str = None, lease_seconds: int = LEADER_LEASE_SECONDS,
+                 interval: float = LEADER_HEARTBEAT_INTERVAL, rpc_timeout: float = LEADER_RPC_TIMEOUT,
+                 elected_timeout: float = LEADER_ELECTED_TIMEOUT):
+        self.instance_id = instance_id or str(uuid.uuid4())
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.rpc_timeout = rpc_timeout
+        self.elected_timeout = elected_timeout
+        self.is_leader = False
+        self.fencing_token = None
+        self._lease_deadline = 0.0
+        self._on_elected = None
+        self._on_demoted = None
+        self._task = None
+        self._elected_task = None
+
+    async def register(self) -> None:
+        """Регистрирует экземпляр и удаляет записи давно пропавших экземпляров."""
+        supabase = get_supabase()
+        logger.info(f"🔑 Этот инстанс имеет ID: {self.instance_id}")
+        try:
+            stale_before = (datetime.now(timezone.utc) - STALE_INSTANCE_AGE).isoformat()
+            await execute(supabase.table("bot_instances").delete().lt("heartbeat_at", stale_before).eq("is_active", False))
+        except Exception as e:
+            logger.error(f"❌ Ошибка при очистке старых инстансов: {e}")
+        await execute(supabase.table("bot_instances").insert({
+            "instance_id": self.instance_id,
+            "is_active": False,
+        }))
+        logger.info("✅ Инстанс зарегистрирован, ждёт выборов ведущего.")
+
+    async def _acquire(self):
+        supabase = get_supabase()
+        response = await execute(supabase.rpc('acquire_leadership', {
+            'p_instance_id': self.instance_id,
+            'p_lease_seconds': self.lease_seconds,
+        }))
+        return response.data
+
+    async def _tick(self) -> None:
+        started = time.monotonic()
+        try:
+            token = await asyncio.wait_for(self._acquire(), self.rpc_timeout)
+        except Exception as e:
+            logger.error(f"❌ Не удалось продлить аренду ведущего: {e!r}")
+            # Без связи с БД остаёмся ведущим, только если аренда точно переживёт
+            # следующую попытку (и её таймаут): иначе резерв может захватить её,
+            # пока мы ещё обрабатываем обновления
+            next_attempt_done = time.monotonic() + self.interval + self.rpc_timeout
+            if self.is_leader and next_attempt_done >= self._lease_deadline:
+                await self._demote("аренда истекает без связи с БД")
+            return
+
+        if token is None:
+            if self.is_leader:
+                await self._demote("аренду забрал другой инстанс")
+            return
+
+        # Аренда в БД отсчитывается от момента запроса, поэтому локальный срок не позже неё
+        self._lease_deadline = started + self.lease_seconds
+        if self.is_leader:
+            if token != self.fencing_token:
+                # Своя аренда успела истечь, но никто её не забрал: работа уже идёт,
+                # запускать её заново не нужно, меняется только токен
+                logger.info(f"👑 Инстанс {self.instance_id} остался ведущим (новый токен {token})")
+                self.fencing_token = token
+            return
+
+        self.is_leader = True
+        self.fencing_token = token
+        logger.info(f"👑 Инстанс {self.instance_id} стал ведущим (токен {token})")
+        if self._on_elected:
+            # Не ждём здесь: пока работа запускается, аренду нужно продолжать продлевать
+            self._elected_task = asyncio.create_task(self._run_on_elected())
+
+    async def _run_on_elected(self) -> None:
+        try:
+            await asyncio.wait_for(self._on_elected(), self.elected_timeout)
+        except Exception as e:
+            # Не смогли начать работу — откатываемся и попробуем на следующем шаге
+            logger.exception(f"💥 Не удалось начать работу ведущего: {e!r}")
+            await self._demote("ошибка при запуске")
+
+    async def _demote(self, reason: str) -> None:
+        self.is_leader = False
+        self.fencing_token = None
+        # Запуск работы ведущего мог ещё идти: дожидаемся его отмены, иначе он
+        # начал бы polling уже после того, как аренду забрал другой инстанс
+        task, self._elected_task = self._elected_task, None
+        if task is not None and task is not asyncio.current_task() and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        logger.warning(f"🪑 Инстанс {self.instance_id} больше не ведущий: {reason}")
+        if self._on_demoted:
+            await self._on_demoted()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self._tick()
+            except Exception as e:
+                logger.exception(f"💥 Ошибка в выборах ведущего: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, on_elected=None, on_demoted=None) -> None:
+        """Запускает фоновые выборы. on_elected/on_demoted — корутины без аргументов."""
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Останавливает выборы и отдаёт аренду, чтобы резерв подхватил работу сразу."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            await self._demote("остановка инстанса")
+        try:
+            await execute(get_supabase().rpc('release_leadership', {'p_instance_id': self.instance_id}))
+        except Exception as e:
+            logger.error(f"❌ Не удалось освободить аренду ведущего: {e}")
+
+
+leader_election = LeaderElection()
@@ -0,0 +1,39 @@
+# bot/services/segments.py
+
+# Статусы пользователя по отношению к рассылкам. Они взаимоисключающие и в сумме
+# дают всех пользователей; /stats, /list_subscribers, /export и сами рассылки
+# берут определения отсюда. NULL в can_receive_broadcast значит «подписан»
+# (как и значение по умолчанию в таблице), NULL в is_banned — «не заблокирован».
+
+def banned(query):
+    """Заблокированы: is_banned = true или banned_features содержит 'all'."""
+    return query.or_('is_banned.eq.true,banned_features.cs.{all}')
+
+def _not_banned(query):
+    return query.not_.is_('is_banned', 'true').or_('banned_features.is.null,banned_features.not.cs.{all}')
+
+def _subscribed(query):
+    return _not_banned(query).not_.is_('can_receive_broadcast', 'false')
+
+def receiving(query):
+    """Получают рассылки: не заблокированы, не отписались и доступны."""
+    return _subscribed(query).is_('unreachable_at', 'null')
+
+def opted_out(query):
+    """Сами отключили рассылки (и не заблокированы)."""
+    return _not_banned(query).is_('can_receive_broadcast', 'false')
+
+def unreachable(query):
+    """Подписаны, но доставка невозможна (бот заблокирован, чат удалён)."""
+    return _subscribed(query).not_.is_('unreachable_at', 'null')
+
+def subscriber_status(user: dict) -> str:
+    """То же разбиение для уже загруженной строки users:
+    'banned', 'opted_out', 'unreachable' или 'receiving'."""
+    if user.get('is_banned') or 'all' in (user.get('banned_features') or []):
+        return 'banned'
+    if user.get('can_receive_broadcast') is False:
+        return 'opted_out'
+    if user.get('unreachable_at'):
+        return 'unreachable'
+    return 'receiving'
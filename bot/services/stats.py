@@ -0,0 +1,52 @@
+# bot/services/stats.py
+import asyncio
+import logging
+from bot.database.pagination import count_rows
+from bot.services.broadcast_jobs import SEGMENTS
+from bot.services import segments
+
+logger = logging.getLogger(__name__)
+
+# (ключ, подпись, фильтр). Все счётчики считаются на стороне БД запросами count без строк.
+STATS_COUNTERS = [
+    ('all', "👥 Всего пользователей", None),
+    ('squad', "🛡️ В скваде", SEGMENTS['squad']),
+    ('city', "🏙️ В городе", SEGMENTS['city']),
+    ('starly', "⭐ Старли (сквад или город)", SEGMENTS['starly']),
+    ('subscribers', "🔔 Получают рассылки", segments.receiving),
+    ('not_receiving', "🔕 Отключили рассылки", segments.opted_out),
+    ('unreachable', "📵 Недоступны для рассылок", segments.unreachable),
+    ('banned', "❌ Заблокированы", segments.banned),
+    ('restricted', "⛔ С ограничениями (анкеты/обращения)", lambda q: q.ov('banned_features', ['anketa', 'appeal'])),
+]
+
+# Сводка для /list_subscribers: те же группы, что и в списке подписчиков.
+# Группы не пересекаются, поэтому каждая считается напрямую, а не вычитанием.
+SUBSCRIBER_COUNTERS = [
+    ('all', "👥 Всего", None),
+    ('receiving', "🔔 Получают рассылки", segments.receiving),
+    ('not_receiving', "🔕 Отключили рассылки", segments.opted_out),
+    ('unreachable', "📵 Недоступны", segments.unreachable),
+    ('banned', "❌ Заблокированы", segments.banned),
+]
+
+async def collect_counts(counters: list) -> dict:
+    """Считает все счётчики параллельно. Возвращает {ключ: число}."""
+    results = await asyncio.gather(*(count_rows('users', apply_filters) for _, _, apply_filters in counters))
+    return {key: count for (key, _, _), count in zip(counters, results)}
+
+async def format_stats() -> str:
+    """Текст для /stats."""
+    counts = await collect_counts(STATS_COUNTERS)
+    lines = [f"{label}: {counts[key]}" for key, label, _ in STATS_COUNTERS]
+    return "📊 *Статистика*\n" + "\n".join(lines)
+
+async def format_subscriber_summary() -> str:
+    """Краткая сводка по подписчикам рассылок (без списка пользователей)."""
+    counts = await collect_counts(SUBSCRIBER_COUNTERS)
+    lines = [f"{label}: {counts[key]}" for key, label, _ in SUBSCRIBER_COUNTERS[1:]]
+    return (
+        f"📬 *Подписчики рассылок* (всего {counts['all']})\n"
+        + "\n".join(lines)
+        + "\n\nСписок: /list_subscribers list"
+    )
@@ -0,0 +1,82 @@
+# bot/services/update_processor.py
+import os
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений обрабатывается одновременно (для разных чатов)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления параллельно, но по порядку внутри одного чата.
+
+    Медленный обработчик одного пользователя (запрос к Supabase, рассылка)
+    больше не задерживает остальных, а обновления одного чата идут строго
+    друг за другом, поэтому состояния ConversationHandler не путаются.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # ключ чата -> [asyncio.Lock, число ожидающих и выполняющихся]
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.processed = 0
+
+    @staticmethod
+    def _key(update: object):
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine) -> None:
+        # Сначала встаём в очередь своего чата, и только потом занимаем общий слот:
+        # иначе один активный чат мог бы занять ожиданием все слоты.
+        self.waiting += 1
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        self.waiting -= 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await coroutine
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.max_concurrent_updates,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'waiting': self.waiting,
+            'chats': len(self._locks),
+            'processed': self.processed,
+        }
@@ -1,9 +1,10 @@
-# run.py (без обработки вебхука, только heartbeat)
+# run.py (heartbeat и, в режиме BOT_MODE=webhook, приём обновлений Telegram)
 
 import asyncio
 import logging
 import sys
 import os
+import hmac
 from aiohttp import web
 from datetime import datetime
 
@@ -74,13 +75,44 @@ async def heartbeat_handler(request):
         "message": "Bot service is running"
     })
 
+async def webhook_handler(request):
+    """Принимает обновление от Telegram и ставит его в очередь бота."""
+    from telegram import Update
+
+    # Обновления обрабатывает только ведущий инстанс; Telegram повторит запрос позже.
+    # Проверяем это до секрета: резерв отвечает 503, а не 403, и Telegram не
+    # считает вебхук сломанным, пока запрос не дойдёт до ведущего
+    leader = app_context.get("leader")
+    if leader is not None and not leader.is_leader:
+        return web.Response(status=503)
+
+    secret = app_context.get("webhook_secret", "")
+    received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not secret or not hmac.compare_digest(received, secret):
+        logger.warning("⚠️ Запрос на вебхук с неверным секретом отклонён.")
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        update = Update.de_json(data, bot_application.bot)
+    except Exception as e:
+        logger.error(f"❌ Не удалось разобрать обновление вебхука: {e}")
+        return web.Response(status=400)
+
+    # Обработка идёт в Application, Telegram получает ответ сразу
+    await bot_application.update_queue.put(update)
+    return web.Response()
+
 async def setup_app():
     """Настраивает aiohttp приложение."""
     app = web.Application()
     # Добавляем обработчики для heartbeat
     app.router.add_get('/heartbeat', heartbeat_handler)
     app.router.add_get('/', heartbeat_handler) # Render использует GET / для проверки
-    # НЕ добавляем маршрут для вебхука, так как используем polling
+    if app_context.get("mode") == "webhook":
+        from bot.main import get_webhook_path
+        app.router.add_post(get_webhook_path(), webhook_handler)
+        logger.info(f"🔗 Маршрут вебхука: POST {get_webhook_path()}")
     return app
 
 async def main():
@@ -97,7 +129,7 @@ async def main():
     # Настраиваем heartbeat-сервер
     web_app = await setup_app()
     
-    # Запускаем heartbeat-сервер на порту
+    # Запускаем heartbeat-сервер (и вебхук) на порту
     port = int(os.environ.get('PORT', 10000))
     runner = web.AppRunner(web_app)
     await runner.setup()
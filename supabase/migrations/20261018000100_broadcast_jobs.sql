@@ -0,0 +1,17 @@
+-- Персистентные задания рассылки: позволяют продолжить рассылку после перезапуска бота.
+create table if not exists broadcast_jobs (
+    id bigserial primary key,
+    segment text not null,                     -- all | squad | city | starly
+    title text not null,                       -- заголовок для отчёта админу
+    admin_chat_id bigint,                      -- куда отправлять отчёт
+    message jsonb,                             -- Message.to_dict() исходного сообщения, если рассылка ответом
+    text text,                                 -- текст, если рассылка командой с текстом
+    status text not null default 'running',    -- running | paused | done | cancelled
+    cursor bigint,                             -- user_id, до которого (включительно) рассылка завершена
+    sent integer not null default 0,
+    failed integer not null default 0,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists broadcast_jobs_status_idx on broadcast_jobs (status);
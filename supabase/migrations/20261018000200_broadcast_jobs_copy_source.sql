@@ -0,0 +1,4 @@
+-- Рассылки копируют исходное сообщение (или альбом) через copy_message/copy_messages,
+-- поэтому вместо полного Message храним только его адрес.
+alter table broadcast_jobs add column if not exists from_chat_id bigint;
+alter table broadcast_jobs add column if not exists message_ids bigint[];
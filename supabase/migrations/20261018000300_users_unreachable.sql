@@ -0,0 +1,5 @@
+-- Пользователи, которым доставка невозможна (заблокировали бота, удалили аккаунт).
+-- Рассылки их пропускают, пока пользователь снова не нажмёт /start.
+alter table users add column if not exists unreachable_at timestamptz;
+
+create index if not exists users_reachable_idx on users (user_id) where unreachable_at is null;
@@ -0,0 +1,18 @@
+-- Всё, что нужно для проверки перед началом анкеты или обращения, одним запросом:
+-- бан, ограничения, незавершённые анкеты/обращения и время последних отправок.
+create or replace function get_form_eligibility(p_user_id bigint)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'is_banned', coalesce(u.is_banned, false),
+        'banned_features', coalesce(u.banned_features, '{}'),
+        'last_anketa_time', u.last_anketa_time,
+        'last_appeal_time', u.last_appeal_time,
+        'has_anketa_draft', exists (select 1 from temp_applications where user_id = p_user_id),
+        'has_appeal_draft', exists (select 1 from temp_appeals where user_id = p_user_id)
+    )
+    from (select 1) as one
+    left join users u on u.user_id = p_user_id;
+$$;
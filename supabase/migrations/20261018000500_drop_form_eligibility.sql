@@ -0,0 +1,4 @@
+-- Ответы незавершённых анкет и обращений теперь хранятся в состоянии разговора бота,
+-- а проверка перед началом формы читает закэшированный профиль.
+-- Таблицы temp_applications и temp_appeals больше не используются ботом.
+drop function if exists get_form_eligibility(bigint);
@@ -0,0 +1,36 @@
+-- Атомарные изменения пользователя одним запросом: без чтения строки в бот
+-- и без потерянных обновлений при одновременных действиях админов.
+-- Каждая функция возвращает новое значение поля или null, если пользователя нет.
+
+create or replace function add_banned_feature(p_user_id bigint, p_feature text)
+returns text[]
+language sql
+as $$
+    update users
+    set banned_features = case
+        when p_feature = any(coalesce(banned_features, '{}')) then banned_features
+        else array_append(coalesce(banned_features, '{}'), p_feature)
+    end
+    where user_id = p_user_id
+    returning banned_features;
+$$;
+
+create or replace function remove_banned_feature(p_user_id bigint, p_feature text)
+returns text[]
+language sql
+as $$
+    update users
+    set banned_features = array_remove(coalesce(banned_features, '{}'), p_feature)
+    where user_id = p_user_id
+    returning banned_features;
+$$;
+
+create or replace function toggle_broadcast(p_user_id bigint)
+returns boolean
+language sql
+as $$
+    update users
+    set can_receive_broadcast = not coalesce(can_receive_broadcast, true)
+    where user_id = p_user_id
+    returning can_receive_broadcast;
+$$;
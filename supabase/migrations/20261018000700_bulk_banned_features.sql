@@ -0,0 +1,18 @@
+-- Ограничение сразу для многих пользователей одним запросом (/restrict со списком).
+-- Возвращает изменённые строки, чтобы бот обновил кэш профилей.
+
+create or replace function add_banned_feature_bulk(p_user_ids bigint[], p_feature text)
+returns setof users
+language sql
+as $$
+    update users
+    set banned_features = case
+        when p_feature = any(coalesce(banned_features, '{}')) then banned_features
+        else array_append(coalesce(banned_features, '{}'), p_feature)
+    end
+    where user_id = any(p_user_ids)
+    returning *;
+$$;
+
+-- Заменена add_banned_feature_bulk
+drop function if exists add_banned_feature(bigint, text);
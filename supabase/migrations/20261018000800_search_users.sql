@@ -0,0 +1,35 @@
+-- Поиск пользователей для /find: подстрока в username/имени/фамилии или префикс user_id.
+-- Триграммные индексы ускоряют ilike '%...%', индекс по user_id::text — поиск по префиксу.
+create extension if not exists pg_trgm;
+
+create index if not exists users_username_trgm_idx on users using gin (username gin_trgm_ops);
+create index if not exists users_first_name_trgm_idx on users using gin (first_name gin_trgm_ops);
+create index if not exists users_last_name_trgm_idx on users using gin (last_name gin_trgm_ops);
+create index if not exists users_user_id_text_idx on users ((user_id::text) text_pattern_ops);
+
+create or replace function search_users(p_query text, p_limit int default 10)
+returns setof users
+language sql
+stable
+as $$
+    with q as (
+        -- Экранируем спецсимволы LIKE: в username часто встречается «_»
+        select replace(replace(replace(ltrim(trim(p_query), '@'), '\', '\\'), '%', '\%'), '_', '\_') as term
+    )
+    select u.*
+    from users u, q
+    where q.term <> ''
+      and (u.username ilike '%' || q.term || '%'
+           or u.first_name ilike '%' || q.term || '%'
+           or u.last_name ilike '%' || q.term || '%'
+           or u.user_id::text like q.term || '%')
+    order by
+        -- Сначала точное совпадение username, затем совпадения с начала, затем остальные
+        (u.username ilike q.term) desc,
+        (u.username ilike q.term || '%'
+         or u.first_name ilike q.term || '%'
+         or u.last_name ilike q.term || '%'
+         or u.user_id::text like q.term || '%') desc,
+        u.user_id
+    limit least(greatest(p_limit, 1), 50);
+$$;
@@ -0,0 +1,61 @@
+-- Выбор ведущего экземпляра бота по аренде (lease) в bot_instances.
+-- Ведущий продлевает аренду каждые несколько секунд; если он пропал, аренда
+-- истекает и её забирает резервный экземпляр. Каждый новый ведущий получает
+-- больший fencing_token, по которому отсекаются записи устаревшего ведущего.
+alter table bot_instances add column if not exists heartbeat_at timestamptz not null default now();
+alter table bot_instances add column if not exists lease_expires_at timestamptz;
+alter table bot_instances add column if not exists fencing_token bigint;
+
+create sequence if not exists bot_leader_fencing_seq;
+
+-- Продлевает или захватывает аренду. Возвращает fencing_token, если экземпляр
+-- ведущий, и null, если аренда у другого живого экземпляра.
+create or replace function acquire_leadership(p_instance_id text, p_lease_seconds int)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_token bigint;
+begin
+    update bot_instances set heartbeat_at = now() where instance_id = p_instance_id;
+
+    -- Выборы идут строго по одному
+    perform pg_advisory_xact_lock(hashtext('bot_leader'));
+
+    if exists (
+        select 1 from bot_instances
+        where is_active and lease_expires_at > now() and instance_id <> p_instance_id
+    ) then
+        return null;
+    end if;
+
+    update bot_instances set is_active = false where is_active and instance_id <> p_instance_id;
+
+    update bot_instances
+    set is_active = true,
+        -- Продление своей действующей аренды сохраняет токен, новый захват — выдаёт новый
+        fencing_token = case
+            when is_active and lease_expires_at > now() and fencing_token is not null then fencing_token
+            else nextval('bot_leader_fencing_seq')
+        end,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    where instance_id = p_instance_id
+    returning fencing_token into v_token;
+
+    return v_token;
+end;
+$$;
+
+-- Добровольно отдаёт аренду (при остановке), чтобы резерв подхватил работу сразу.
+create or replace function release_leadership(p_instance_id text)
+returns void
+language sql
+as $$
+    update bot_instances
+    set is_active = false, lease_expires_at = now()
+    where instance_id = p_instance_id;
+$$;
+
+-- Задания рассылки помнят токен ведущего, который их выполняет:
+-- записи с меньшим токеном (от бывшего ведущего) не применяются.
+alter table broadcast_jobs add column if not exists fencing_token bigint;
@@ -0,0 +1,44 @@
+-- acquire_leadership сам создаёт запись экземпляра, если её нет. Раньше функция
+-- только обновляла строку, и инстанс, чья регистрация при старте не удалась,
+-- молча оставался вне выборов навсегда.
+create or replace function acquire_leadership(p_instance_id text, p_lease_seconds int)
+returns bigint
+language plpgsql
+as $$
+declare
+    v_token bigint;
+begin
+    update bot_instances set heartbeat_at = now() where instance_id = p_instance_id;
+    if not found then
+        -- Регистрация при старте не удалась (или запись удалили как устаревшую):
+        -- без строки экземпляр никогда не смог бы стать ведущим
+        insert into bot_instances (instance_id, is_active, heartbeat_at)
+        values (p_instance_id, false, now());
+    end if;
+
+    -- Выборы идут строго по одному
+    perform pg_advisory_xact_lock(hashtext('bot_leader'));
+
+    if exists (
+        select 1 from bot_instances
+        where is_active and lease_expires_at > now() and instance_id <> p_instance_id
+    ) then
+        return null;
+    end if;
+
+    update bot_instances set is_active = false where is_active and instance_id <> p_instance_id;
+
+    update bot_instances
+    set is_active = true,
+        -- Продление своей действующей аренды сохраняет токен, новый захват — выдаёт новый
+        fencing_token = case
+            when is_active and lease_expires_at > now() and fencing_token is not null then fencing_token
+            else nextval('bot_leader_fencing_seq')
+        end,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    where instance_id = p_instance_id
+    returning fencing_token into v_token;
+
+    return v_token;
+end;
+$$;
@@ -0,0 +1,30 @@
+-- search_users: ключи сортировки не могут быть NULL. Раньше пользователь без
+-- username (или с пустым именем) получал NULL, который в desc идёт первым, и
+-- вытеснял точное совпадение @username за пределы limit.
+create or replace function search_users(p_query text, p_limit int default 10)
+returns setof users
+language sql
+stable
+as $$
+    with q as (
+        -- Экранируем спецсимволы LIKE: в username часто встречается «_»
+        select replace(replace(replace(ltrim(trim(p_query), '@'), '\', '\\'), '%', '\%'), '_', '\_') as term
+    )
+    select u.*
+    from users u, q
+    where q.term <> ''
+      and (u.username ilike '%' || q.term || '%'
+           or u.first_name ilike '%' || q.term || '%'
+           or u.last_name ilike '%' || q.term || '%'
+           or u.user_id::text like q.term || '%')
+    order by
+        -- Сначала точное совпадение username, затем совпадения с начала, затем остальные.
+        -- NULL в username/имени даёт NULL, а в desc NULL идёт первым, поэтому coalesce
+        coalesce(u.username ilike q.term, false) desc,
+        coalesce(u.username ilike q.term || '%'
+                 or u.first_name ilike q.term || '%'
+                 or u.last_name ilike q.term || '%'
+                 or u.user_id::text like q.term || '%', false) desc,
+        u.user_id
+    limit least(greatest(p_limit, 1), 50);
+$$;
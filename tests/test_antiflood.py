@@ -0,0 +1,13 @@
+# tests/test_antiflood.py
+from bot.services.antiflood import FloodGuard, ALLOW, MUTE, DROP
+
+
+def test_custom_limit_is_respected():
+    # Лимит экземпляра, а не модульный FLOOD_LIMIT, задаёт размер окна
+    guard = FloodGuard(limit=3, window=10)
+    decisions = [guard.check(1, str(i)) for i in range(5)]
+    assert decisions == [ALLOW, ALLOW, ALLOW, MUTE, DROP]
+
+    roomy = FloodGuard(limit=20, window=10)
+    assert all(roomy.check(2, str(i)) == ALLOW for i in range(20))
+    assert roomy.check(2, 'next') == MUTE
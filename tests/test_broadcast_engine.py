@@ -0,0 +1,65 @@
+# tests/test_broadcast_engine.py
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+from bot.services.broadcast_engine import BroadcastEngine, BroadcastControl, RateLimiter
+
+SLOW_CHAT = 3
+SLOW_DELAY = 0.3
+
+
+def _engine(send, control=None) -> BroadcastEngine:
+    return BroadcastEngine(send, concurrency=4, rate_limiter=RateLimiter(rate=1e6, per_chat_rate=1e6), control=control)
+
+
+async def _pages(total: int, page_size: int):
+    for start in range(1, total + 1, page_size):
+        yield list(range(start, min(start + page_size, total + 1)))
+
+
+def test_slow_recipient_does_not_stall_next_pages():
+    sent_while_slow = []
+    slow = {'started': False, 'done': False}
+    checkpoints = []
+    early_checkpoints = []
+
+    async def send(chat_id):
+        if chat_id == SLOW_CHAT:
+            slow['started'] = True
+            await asyncio.sleep(SLOW_DELAY)
+            slow['done'] = True
+        elif slow['started'] and not slow['done']:
+            sent_while_slow.append(chat_id)
+
+    async def checkpoint(chat_id) -> bool:
+        checkpoints.append(chat_id)
+        if not slow['done']:
+            early_checkpoints.append(chat_id)
+        return True
+
+    stats = asyncio.run(_engine(send).run_stream(_pages(40, 5), checkpoint=checkpoint, checkpoint_every=5))
+
+    assert stats.sent == 40
+    # Пока отправка в SLOW_CHAT висит, остальные страницы уже рассылаются
+    assert any(chat_id > 5 for chat_id in sent_while_slow)
+    # Отметка не обгоняет незавершённую отправку и в конце доходит до последнего получателя
+    assert checkpoints == sorted(checkpoints)
+    assert all(chat_id < SLOW_CHAT for chat_id in early_checkpoints)
+    assert checkpoints[-1] == 40
+
+
+def test_rejected_checkpoint_hands_over():
+    control = BroadcastControl()
+
+    async def send(chat_id):
+        await asyncio.sleep(0)
+
+    async def checkpoint(chat_id) -> bool:
+        return False
+
+    stats = asyncio.run(_engine(send, control).run_stream(_pages(1000, 50), checkpoint=checkpoint, checkpoint_every=10))
+
+    assert control.handed_over
+    assert stats.sent < 1000
@@ -0,0 +1,62 @@
+# tests/test_db_concurrency.py
+import time
+import asyncio
+from datetime import datetime, timezone
+import pytest
+
+pytest.importorskip("telegram")
+# Каталог supabase/ с миграциями виден как пустой пакет, поэтому проверяем его зависимость
+pytest.importorskip("postgrest")
+
+from telegram import Chat, Message, Update, User
+from bot.database import core
+from bot.database.core import execute
+from bot.services.update_processor import OrderedUpdateProcessor
+
+QUERY_DELAY = 0.1
+UPDATES = 50
+
+
+class SlowQuery:
+    """Запрос PostgREST, который отвечает за QUERY_DELAY секунд (как медленная сеть)."""
+
+    def execute(self):
+        time.sleep(QUERY_DELAY)
+        return None
+
+
+def _start_update(update_id: int) -> Update:
+    user = User(id=update_id, first_name="user", is_bot=False)
+    chat = Chat(id=update_id, type=Chat.PRIVATE)
+    message = Message(message_id=1, date=datetime.now(timezone.utc), chat=chat, from_user=user, text="/start")
+    return Update(update_id=update_id, message=message)
+
+
+async def _process(processor, updates) -> float:
+    async def handler():
+        # Как /start: обращение к БД через execute()
+        await execute(SlowQuery())
+
+    started = time.monotonic()
+    await asyncio.gather(*(processor.process_update(update, handler()) for update in updates))
+    return time.monotonic() - started
+
+
+def test_start_updates_from_different_users_run_concurrently():
+    processor = OrderedUpdateProcessor(max_concurrent_updates=UPDATES)
+    elapsed = asyncio.run(_process(processor, [_start_update(i) for i in range(1, UPDATES + 1)]))
+
+    serial = UPDATES * QUERY_DELAY
+    # Параллельность ограничена пулом потоков БД, а не обработкой по одному обновлению
+    expected = UPDATES / core.DB_MAX_WORKERS * QUERY_DELAY
+    assert elapsed < serial / 2
+    assert elapsed < expected * 2 + 0.5
+    assert processor.processed == UPDATES
+
+
+def test_updates_from_one_chat_stay_sequential():
+    processor = OrderedUpdateProcessor(max_concurrent_updates=UPDATES)
+    updates = [_start_update(1) for _ in range(5)]
+    elapsed = asyncio.run(_process(processor, updates))
+
+    assert elapsed >= 5 * QUERY_DELAY * 0.9
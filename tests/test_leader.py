@@ -0,0 +1,88 @@
+# tests/test_leader.py
+import time
+import asyncio
+import pytest
+
+# Каталог supabase/ с миграциями виден как пустой пакет, поэтому проверяем его зависимость
+pytest.importorskip("postgrest")
+pytest.importorskip("telegram")
+
+from bot.services.leader import LeaderElection
+
+
+def _election(tokens) -> tuple:
+    """Выборы, где каждый вызов acquire_leadership берёт следующий ответ из tokens."""
+    election = LeaderElection('test', lease_seconds=15, interval=5, rpc_timeout=2.5)
+    calls = {'elected': 0, 'demoted': 0}
+    answers = iter(tokens)
+
+    async def acquire():
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def on_elected():
+        calls['elected'] += 1
+
+    async def on_demoted():
+        calls['demoted'] += 1
+
+    election._acquire = acquire
+    election._on_elected = on_elected
+    election._on_demoted = on_demoted
+    return election, calls
+
+
+def test_reacquired_lease_does_not_restart_leader_work():
+    election, calls = _election([1, 1, 2])
+
+    async def ticks():
+        for _ in range(3):
+            await election._tick()
+            # Запуск работы ведущего идёт отдельной задачей
+            await asyncio.sleep(0)
+
+    asyncio.run(ticks())
+    assert calls == {'elected': 1, 'demoted': 0}
+    assert election.is_leader and election.fencing_token == 2
+
+
+def test_leader_steps_down_before_lease_can_expire():
+    election, calls = _election([1, ConnectionError(), ConnectionError()])
+
+    async def scenario():
+        await election._tick()
+        await asyncio.sleep(0)
+        # Аренды хватит ещё на одну попытку — остаёмся ведущим
+        await election._tick()
+        assert election.is_leader
+        # Следующая попытка закончилась бы позже срока аренды — уходим заранее
+        election._lease_deadline = time.monotonic() + election.interval
+        await election._tick()
+
+    asyncio.run(scenario())
+    assert calls == {'elected': 1, 'demoted': 1}
+    assert not election.is_leader
+
+
+def test_lost_lease_cancels_unfinished_leader_start():
+    election, calls = _election([1, None])
+    started_polling = []
+
+    async def slow_on_elected():
+        await asyncio.sleep(10)
+        started_polling.append(True)
+
+    election._on_elected = slow_on_elected
+
+    async def scenario():
+        await election._tick()
+        await asyncio.sleep(0)
+        # Пока работа запускается, аренду забрал другой инстанс
+        await election._tick()
+
+    asyncio.run(scenario())
+    assert not election.is_leader
+    assert started_polling == []
+    assert calls['demoted'] == 1
@@ -0,0 +1,17 @@
+# tests/test_segments.py
+import pytest
+
+from bot.services.segments import subscriber_status
+
+
+@pytest.mark.parametrize('user, status', [
+    ({'is_banned': True, 'can_receive_broadcast': True}, 'banned'),
+    ({'is_banned': None, 'banned_features': ['all'], 'can_receive_broadcast': False}, 'banned'),
+    ({'is_banned': False, 'banned_features': None, 'can_receive_broadcast': False}, 'opted_out'),
+    ({'is_banned': None, 'can_receive_broadcast': None, 'unreachable_at': None}, 'receiving'),
+    ({'can_receive_broadcast': True, 'unreachable_at': '2026-10-01T00:00:00+00:00'}, 'unreachable'),
+    ({'banned_features': ['anketa'], 'can_receive_broadcast': True}, 'receiving'),
+])
+def test_subscriber_status(user, status):
+    # NULL в флагах трактуется так же, как в фильтрах segments.*
+    assert subscriber_status(user) == status